@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# pylint: disable=missing-docstring
+
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import toml
+
+from cita_cloud_operator import str_to_bool, load_service_config, verify_service_config, \
+    compile_container_templates, gen_node_deployment, gen_all_service, gen_kms_secret_name_mc, \
+    parse_arguments as parse_operator_arguments, run_operator, ChainSpec, generate_chain, dump_k8s_config, \
+    gen_spec_inputs_hash, gen_node_inputs_hash
+from k8s_schema import load_validator
+
+
+CHAINCODE_EXECUTOR_IMAGE = 'citacloud/executor_chaincode_ext'
+
+# commands which do no real work, and the heavy modules they must not import
+STARTUP_COMMANDS = [
+    (['cita_cloud_operator.py', '-h'], ['toml', 'yaml', 'concurrent.futures.process', 'tempfile']),
+    (['cita_cloud_operator.py', '--kms_passwords', '123456'], ['toml', 'yaml', 'concurrent.futures.process', 'tempfile']),
+    (['create_pvc.py', '-h'], ['yaml']),
+    (['gen_sm2_keypair.py', '-h'], ['pysmx']),
+]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--service_config', default='./service-config.toml', help='Config file about service information.')
+
+    parser.add_argument(
+        '--chain_name', default='test-chain', help='The name of chain.')
+
+    parser.add_argument(
+        '--nodes', default='10,100,1000,10000', help='The list of node counts of the chain.')
+
+    parser.add_argument(
+        '--repeat', type=int, default=3, help='Times to repeat each benchmark, the best one is reported.')
+
+    parser.add_argument(
+        '--all_combinations',
+        type=str_to_bool,
+        default=True,
+        help='Run all combinations of monitor, debug, executor and registry, or only the default one')
+
+    parser.add_argument(
+        '--jobs', type=int, default=1, help='The --jobs passed to run_operator.')
+
+    parser.add_argument(
+        '--output', default='benchmark.json', help='The file to write results to.')
+
+    parser.add_argument(
+        '--baseline', help='Results of a previous run to compare with.')
+
+    parser.add_argument(
+        '--startup_only',
+        type=str_to_bool,
+        default=False,
+        help='Only measure the import time of entry points')
+
+    args = parser.parse_args()
+    return args
+
+
+# synthetic inputs of one benchmark case
+class Case:
+    def __init__(self, nodes, need_monitor, need_debug, is_chaincode_executor, is_custom_registry):
+        self.nodes = nodes
+        self.need_monitor = need_monitor
+        self.need_debug = need_debug
+        self.is_chaincode_executor = is_chaincode_executor
+        self.is_custom_registry = is_custom_registry
+        self.docker_registry = 'registry.example.com' if is_custom_registry else None
+        self.docker_image_namespace = 'citacloud' if is_custom_registry else None
+
+    def key(self):
+        return 'nodes={},monitor={},debug={},chaincode_ext={},registry={}'.format(
+            self.nodes, self.need_monitor, self.need_debug, self.is_chaincode_executor, self.is_custom_registry)
+
+    def to_dict(self):
+        return {
+            'nodes': self.nodes,
+            'need_monitor': self.need_monitor,
+            'need_debug': self.need_debug,
+            'chaincode_ext_executor': self.is_chaincode_executor,
+            'custom_registry': self.is_custom_registry,
+        }
+
+    def service_config(self, service_config):
+        services = []
+        for service in service_config['services']:
+            service = dict(service)
+            if service['name'] == 'executor' and self.is_chaincode_executor:
+                service['docker_image'] = CHAINCODE_EXECUTOR_IMAGE
+            services.append(service)
+        return {'services': services}
+
+    def operator_argv(self, chain_name, work_dir, service_config_path, jobs):
+        argv = [
+            '--work_dir', work_dir,
+            '--chain_name', chain_name,
+            '--service_config', service_config_path,
+            '--kms_passwords', ','.join('password-{}'.format(i) for i in range(self.nodes)),
+            '--lbs_tokens', ','.join('lb-{}'.format(i) for i in range(self.nodes)),
+            '--node_ports', ','.join(str(30000 + 10 * i) for i in range(self.nodes)),
+            '--pvc_names', ','.join(['nas-pvc'] * self.nodes),
+            '--need_monitor', str(self.need_monitor),
+            '--need_debug', str(self.need_debug),
+            '--jobs', str(jobs),
+            '--incremental', 'false',
+        ]
+        if self.is_custom_registry:
+            argv += ['--docker_registry', self.docker_registry, '--docker_image_namespace', self.docker_image_namespace]
+        return argv
+
+
+def gen_cases(node_counts, all_combinations):
+    if all_combinations:
+        flags = list(itertools.product([False, True], repeat=4))
+    else:
+        flags = [(False, False, False, False)]
+    return [Case(nodes, *flag) for nodes in node_counts for flag in flags]
+
+
+# run func repeat times for the best wall time, then once more with tracemalloc for the peak memory
+def measure(repeat, func):
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'wall_seconds': min(elapsed), 'peak_memory_bytes': peak}
+
+
+def bench_case(args, case, base_service_config, tmp_dir):
+    service_config = case.service_config(base_service_config)
+    state_db_user = state_db_password = 'citacloud'
+
+    def node_deployment(precompiled):
+        def run():
+            container_templates = None
+            if precompiled:
+                container_templates = compile_container_templates(service_config, state_db_user, state_db_password, case.need_monitor, case.need_debug, case.docker_registry, case.docker_image_namespace)
+            for i in range(case.nodes):
+                gen_node_deployment(i, service_config, args.chain_name, 'nas-pvc', state_db_user, state_db_password, case.need_monitor, gen_kms_secret_name_mc(args.chain_name, i), case.need_debug, case.docker_registry, case.docker_image_namespace, container_templates)
+        return run
+
+    def all_service():
+        for i in range(case.nodes):
+            gen_all_service(i, args.chain_name, 30000 + 10 * i, 'lb-{}'.format(i), case.need_monitor, case.need_debug, case.is_chaincode_executor)
+
+    service_config_path = os.path.join(tmp_dir, 'service-config.toml')
+    with open(service_config_path, 'wt') as stream:
+        toml.dump(service_config, stream)
+    work_dir = os.path.join(tmp_dir, 'output')
+    os.makedirs(work_dir, exist_ok=True)
+    operator_args = parse_operator_arguments(case.operator_argv(args.chain_name, work_dir, service_config_path, args.jobs))
+
+    spec = ChainSpec.from_args(operator_args)
+    k8s_configs = [k8s_config for _, k8s_config in generate_chain(spec)]
+
+    # cache keys of all nodes, as write_chain computes them on every run, per node time must stay flat
+    def inputs_hash():
+        spec_hash = gen_spec_inputs_hash(spec)
+        for i in range(case.nodes):
+            gen_node_inputs_hash(spec, i, spec_hash)
+
+    def yaml_dump():
+        for k8s_config in k8s_configs:
+            dump_k8s_config(k8s_config)
+
+    validator = load_validator()
+
+    def validate():
+        for k8s_config in k8s_configs:
+            validator.check(k8s_config)
+
+    def operator():
+        with open(os.devnull, 'wt') as devnull, contextlib.redirect_stdout(devnull):
+            run_operator(operator_args, work_dir)
+
+    metrics = {
+        'gen_node_deployment': measure(args.repeat, node_deployment(True)),
+        'gen_node_deployment_without_templates': measure(args.repeat, node_deployment(False)),
+        'gen_all_service': measure(args.repeat, all_service),
+        'inputs_hash': measure(args.repeat, inputs_hash),
+        'yaml_dump': measure(args.repeat, yaml_dump),
+        'validate': measure(args.repeat, validate),
+        'run_operator': measure(args.repeat, operator),
+    }
+    for metric in metrics.values():
+        metric['per_node_us'] = metric['wall_seconds'] / case.nodes * 1e6
+    return metrics
+
+
+# run command with -X importtime, return the total import time in us and the imported modules
+def import_time(command):
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    argv = [sys.executable, '-X', 'importtime', os.path.join(script_dir, command[0])] + command[1:]
+    output = subprocess.run(argv, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, cwd=script_dir)
+    total = 0
+    modules = set()
+    for line in output.stderr.decode().splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if not fields[0].strip().isdigit():
+            continue
+        total += int(fields[0])
+        modules.add(fields[2].strip())
+    return total, modules
+
+
+def measure_startup(repeat):
+    results = []
+    for command, forbidden_modules in STARTUP_COMMANDS:
+        elapsed = []
+        for _ in range(repeat):
+            total, modules = import_time(command)
+            elapsed.append(total)
+        results.append({
+            'command': ' '.join(command),
+            'import_us': min(elapsed),
+            'forbidden_imports': sorted(module for module in forbidden_modules if module in modules),
+        })
+    return results
+
+
+def git_commit():
+    try:
+        output = subprocess.run(['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.stdout.decode().strip()
+
+
+def compare_with_baseline(results, baseline_path):
+    with open(baseline_path, 'rt') as stream:
+        baseline = json.load(stream)
+    baseline_cases = {case['key']: case for case in baseline['cases']}
+    print('compare with {} (commit {}):'.format(baseline_path, baseline.get('commit')))
+    baseline_startup = {startup['command']: startup for startup in baseline.get('startup', [])}
+    for startup in results['startup']:
+        old_startup = baseline_startup.get(startup['command'])
+        if old_startup is not None:
+            print('  {}: import time {:.2f}x'.format(startup['command'], startup['import_us'] / max(old_startup['import_us'], 1)))
+    for case in results['cases']:
+        old_case = baseline_cases.get(case['key'])
+        if old_case is None:
+            continue
+        for name, metric in case['metrics'].items():
+            old_metric = old_case['metrics'].get(name)
+            if old_metric is None:
+                continue
+            print('  {} {}: time {:.2f}x, peak memory {:.2f}x'.format(
+                case['key'], name,
+                metric['wall_seconds'] / max(old_metric['wall_seconds'], 1e-9),
+                metric['peak_memory_bytes'] / max(old_metric['peak_memory_bytes'], 1)))
+
+
+def main():
+    args = parse_arguments()
+    base_service_config = load_service_config(args.service_config)
+    verify_service_config(base_service_config)
+
+    node_counts = list(map(lambda x : int(x), args.nodes.split(',')))
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'repeat': args.repeat,
+        'jobs': args.jobs,
+        'startup': measure_startup(args.repeat),
+        'cases': [],
+    }
+    for startup in results['startup']:
+        print('{}: import {} us'.format(startup['command'], startup['import_us']))
+        if startup['forbidden_imports']:
+            print('  imports heavy modules:', startup['forbidden_imports'])
+
+    cases = [] if args.startup_only else gen_cases(node_counts, args.all_combinations)
+    for case in cases:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            metrics = bench_case(args, case, base_service_config, tmp_dir)
+        print(case.key())
+        for name, metric in metrics.items():
+            print('  {}: {:.4f}s, {:.2f} us/node, peak memory {} bytes'.format(name, metric['wall_seconds'], metric['per_node_us'], metric['peak_memory_bytes']))
+        sys.stdout.flush()
+        results['cases'].append({'key': case.key(), 'case': case.to_dict(), 'metrics': metrics})
+
+    with open(args.output, 'wt') as stream:
+        json.dump(results, stream, indent=2)
+    print('results:', os.path.abspath(args.output))
+
+    if args.baseline:
+        compare_with_baseline(results, args.baseline)
+
+    if any(startup['forbidden_imports'] for startup in results['startup']):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
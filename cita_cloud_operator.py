@@ -4,17 +4,62 @@
 
 import argparse
 import os
+import stat
 import sys
-import toml
 import base64
-import yaml
+import collections
+import contextlib
+import dataclasses
+import hashlib
+import json
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 
 DEBUG_DOCKER_IMAGE = 'praqma/network-multitool'
 
+INIT_DOCKER_IMAGE = 'busybox'
+
+# label added by k8s to each pod of a StatefulSet
+STATEFULSET_POD_NAME_LABEL = 'statefulset.kubernetes.io/pod-name'
+
 # IfNotPresent or Always
 DEFAULT_IMAGEPULLPOLICY = 'Always'
 
+# images pinned to digests never change, so the ones on the host are used
+PINNED_IMAGEPULLPOLICY = 'IfNotPresent'
+
+# sidecar: both exporters in the pod of each node, exposed by NodePorts
+# host: one process exporter per host for all nodes on it, the exporter of chain data stays in the pod,
+# both are found by prometheus through the labels of pods instead of NodePorts
+MONITOR_MODES = ['sidecar', 'host']
+
+PROCESS_EXPORTER_DOCKER_IMAGE = 'citacloud/monitor-process-exporter:0.4.1'
+
+# exporter of host mode, shared by all chains, {{.Cgroups}} in its group names needs 0.7.6 or later
+HOST_PROCESS_EXPORTER_DOCKER_IMAGE = 'ncabatoff/process-exporter:0.7.10'
+
+PROCESS_EXPORTER_NAME = 'citacloud-process-exporter'
+
+# where the pre-pull DaemonSet mounts the busybox its init containers run
+PREPULL_BIN_PATH = '/prepull-bin'
+
+# main container of the pre-pull DaemonSet, the images to pull are its init containers
+PAUSE_DOCKER_IMAGE = 'registry.k8s.io/pause:3.9'
+
+# how pods of a chain avoid each other on the hosts
+ANTI_AFFINITY_MODES = ['none', 'preferred', 'required']
+
+DEFAULT_TOPOLOGY_KEY = 'kubernetes.io/hostname'
+
+DEFAULT_PRIORITY_VALUE = 1000000
+
+# None: each new connection goes to any ready node, ClientIP: connections of a client stick to one node
+SESSION_AFFINITY_MODES = ['None', 'ClientIP']
+
+# same as the default of k8s
+DEFAULT_SESSION_AFFINITY_TIMEOUT = 10800
+
 SERVICE_LIST = [
     'network',
     'consensus',
@@ -24,6 +69,42 @@ SERVICE_LIST = [
     'kms',
 ]
 
+# gRPC port of each service, services of a node dial each other at localhost
+SERVICE_GRPC_PORTS = {name: 50000 + index for index, name in enumerate(SERVICE_LIST)}
+
+# pod: all services and sidecars of a node in one pod
+# split: a pod for each service of a node, scheduled, sized and scaled on its own
+LAYOUTS = ['pod', 'split']
+
+# in split layout, sidecars stay in the pod of the service whose localhost they use
+SPLIT_SIDECAR_SERVICES = {
+    'debug': 'controller',
+    'monitor-citacloud': 'controller',
+    'couchdb': 'executor',
+}
+
+# in split layout, the service whose pod serves each port of the all-service
+SPLIT_PORT_SERVICES = {
+    'network': 'network',
+    'debug': 'controller',
+    'rpc': 'controller',
+    'call': 'executor',
+    'exporter': 'controller',
+    'chaincode': 'executor',
+    'eventhub': 'executor',
+}
+
+# in split layout, forwards the gRPC ports of the other services from localhost to their ClusterIP services
+FORWARDER_DOCKER_IMAGE = 'alpine/socat:1.7.4.4'
+
+
+class OperatorError(Exception):
+    pass
+
+
+class InvalidChainSpec(OperatorError):
+    pass
+
 
 def str_to_bool(value):
     if isinstance(value, bool):
@@ -35,7 +116,7 @@ def str_to_bool(value):
     raise ValueError(f'{value} is not a valid boolean value')
 
 
-def parse_arguments():
+def gen_argument_parser():
     parser = argparse.ArgumentParser()
 
     parser.add_argument(
@@ -56,10 +137,78 @@ def parse_arguments():
 
     parser.add_argument(
         '--node_ports',
-        help='The list of start port of Nodeport.')
+        help='The list of start port of Nodeport, allocated from port_range if not set.')
+
+    parser.add_argument(
+        '--port_allocations',
+        help='File of ports allocated to all chains, default is port-allocations.json in work_dir. '
+             'Explicit node_ports are checked against it when set.')
+
+    parser.add_argument(
+        '--port_range', default='30000-32767', help='Range of ports allocated to nodes without node_ports.')
+
+    parser.add_argument(
+        '--pvc_names', help='The list of persistentVolumeClaim names, not used with --statefulset.')
+
+    parser.add_argument(
+        '--statefulset',
+        type=str_to_bool,
+        default=False,
+        help='Run all nodes in one StatefulSet, each node gets its own volume from volumeClaimTemplates')
+
+    parser.add_argument(
+        '--storage_class', help='StorageClass of the volumes of nodes with --statefulset, default StorageClass if not set.')
+
+    parser.add_argument(
+        '--storage_size', default='10Gi', help='Size of the volume of each node with --statefulset.')
+
+    parser.add_argument(
+        '--anti_affinity',
+        choices=ANTI_AFFINITY_MODES,
+        default='none',
+        help='Pod anti-affinity between the nodes of the chain over --topology_key.')
+
+    parser.add_argument(
+        '--topology_spread',
+        type=str_to_bool,
+        default=False,
+        help='Spread the nodes of the chain evenly over --topology_key')
+
+    parser.add_argument(
+        '--topology_key', default=DEFAULT_TOPOLOGY_KEY, help='Node label of the topology domains to spread the nodes over.')
+
+    parser.add_argument(
+        '--pdb',
+        type=str_to_bool,
+        default=False,
+        help='Add a PodDisruptionBudget which keeps the BFT quorum of the chain available')
+
+    parser.add_argument(
+        '--priority_class', help='Add a PriorityClass of this name and use it for the nodes of the chain.')
+
+    parser.add_argument(
+        '--priority_value', type=int, default=DEFAULT_PRIORITY_VALUE, help='Value of the PriorityClass.')
+
+    parser.add_argument(
+        '--rpc_gateway',
+        type=str_to_bool,
+        default=False,
+        help='Generate a NodePort service spreading RPC connections to the controllers of all ready nodes')
+
+    parser.add_argument(
+        '--rpc_gateway_port', type=int, help='NodePort of the RPC gateway, allocated by k8s if not set.')
+
+    parser.add_argument(
+        '--session_affinity',
+        choices=SESSION_AFFINITY_MODES,
+        default='None',
+        help='Session affinity of the RPC gateway.')
 
     parser.add_argument(
-        '--pvc_names', help='The list of persistentVolumeClaim names.')
+        '--session_affinity_timeout',
+        type=int,
+        default=DEFAULT_SESSION_AFFINITY_TIMEOUT,
+        help='Seconds a client sticks to its node with --session_affinity ClientIP.')
     
     parser.add_argument(
         '--need_debug',
@@ -73,6 +222,18 @@ def parse_arguments():
         default=False,
         help='Is need monitor')
 
+    parser.add_argument(
+        '--monitor_mode',
+        choices=MONITOR_MODES,
+        default='sidecar',
+        help='Exporters in the pod of each node, or one process exporter per host with --need_monitor.')
+
+    parser.add_argument(
+        '--layout',
+        choices=LAYOUTS,
+        default='pod',
+        help='All services of a node in one pod, or a Deployment and a ClusterIP service for each service of a node.')
+
     parser.add_argument(
         '--state_db_user', default='citacloud', help='User of state db.')
 
@@ -85,7 +246,77 @@ def parse_arguments():
     parser.add_argument(
         '--docker_image_namespace', help='Namespace of docker images.')
 
-    args = parser.parse_args()
+    parser.add_argument(
+        '--image_lock', help='Lockfile of image digests from image_lock.py, pin all images to digests if set.')
+
+    parser.add_argument(
+        '--prepull',
+        type=str_to_bool,
+        default=False,
+        help='Add a DaemonSet which pulls all images of the chain on every host before the nodes roll out')
+
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        help='Number of processes to generate node config files, 0 means the number of CPUs.')
+
+    parser.add_argument(
+        '--incremental',
+        type=str_to_bool,
+        default=True,
+        help='Skip the nodes whose inputs are unchanged since last run')
+
+    parser.add_argument(
+        '--stream',
+        type=str_to_bool,
+        default=False,
+        help='Write documents of all nodes to stdout instead of files')
+
+    parser.add_argument(
+        '--validate',
+        type=str_to_bool,
+        default=False,
+        help='Check generated objects against the bundled k8s schemas, nodes with invalid objects are reported as failed')
+
+    parser.add_argument(
+        '--profile',
+        type=str_to_bool,
+        default=False,
+        help='Run under cProfile and tracemalloc, write the reports to work_dir and print the time of each phase')
+
+    parser.add_argument(
+        '--metrics_file',
+        help='Write the time of each phase to this file in Prometheus text format, like a .prom file of the textfile collector.')
+
+    parser.add_argument(
+        '--previous_dir',
+        help='Directory of previously generated config files, write patches against them besides config files.')
+
+    parser.add_argument(
+        '--patch_type',
+        default='strategic',
+        choices=['strategic', 'merge'],
+        help='Type of patches written with --previous_dir.')
+
+    parser.add_argument(
+        '--watch_dir',
+        help='Run as daemon, watch chain spec files in this directory and regenerate changed chains into work_dir.')
+
+    parser.add_argument(
+        '--watch_interval', type=float, default=1.0, help='Seconds between two scans of watch_dir.')
+
+    parser.add_argument(
+        '--debounce', type=float, default=2.0, help='Seconds a spec file must stay unchanged before reconcile.')
+
+    parser.add_argument(
+        '--workers', type=int, default=4, help='Max number of chains reconciled at the same time.')
+
+    return parser
+
+
+def parse_arguments(argv=None):
+    args = gen_argument_parser().parse_args(argv)
     return args
 
 
@@ -112,7 +343,17 @@ def gen_kms_secret(kms_password, secret_name):
     return secret
 
 
-def gen_grpc_service(chain_name, node_port):
+# kube-proxy spreads connections, not requests, to the ready controllers of the chain,
+# node_port is allocated by k8s if None, selector is the pods of controllers in split layout
+def gen_grpc_service(chain_name, node_port, session_affinity='None', session_affinity_timeout=DEFAULT_SESSION_AFFINITY_TIMEOUT, selector=None):
+    rpc_port = {
+        'port': 50004,
+        'targetPort': 50004,
+        'nodePort': node_port,
+        'name': 'rpc',
+    }
+    if node_port is None:
+        del rpc_port['nodePort']
     grpc_service = {
         'apiVersion': 'v1',
         'kind': 'Service',
@@ -121,28 +362,42 @@ def gen_grpc_service(chain_name, node_port):
         },
         'spec': {
             'type': 'NodePort',
-            'ports': [
-                {
-                    'port': 50004,
-                    'targetPort': 50004,
-                    'nodePort': node_port,
-                    'name': 'rpc',
-                },
-            ],
-            'selector': {
+            'ports': [rpc_port],
+            'selector': selector or {
                 'chain_name': chain_name
             }
         }
     }
+    if session_affinity == 'ClientIP':
+        grpc_service['spec']['sessionAffinity'] = 'ClientIP'
+        grpc_service['spec']['sessionAffinityConfig'] = {
+            'clientIP': {
+                'timeoutSeconds': session_affinity_timeout,
+            }
+        }
     return grpc_service
 
 
+# nodes whose controller does not accept connections are removed from the endpoints of the RPC gateway
+def gen_rpc_readiness_probe():
+    return {
+        'tcpSocket': {
+            'port': 50004,
+        },
+        'initialDelaySeconds': 5,
+        'periodSeconds': 10,
+        'failureThreshold': 3,
+    }
+
+
 def gen_network_secret_name(chain_name, i):
     return '{}-{}-network-secret'.format(chain_name, i)
 
 
-def gen_network_secret(chain_name, i):
-    network_key = '0x' + os.urandom(32).hex()
+# network_key is the base64 data of a secret generated before, a new key is generated if None
+def gen_network_secret(chain_name, i, network_key=None):
+    if network_key is None:
+        network_key = base64.b64encode(bytes('0x' + os.urandom(32).hex(), encoding='utf8')).decode('utf-8')
     netwok_secret = {
         'apiVersion': 'v1',
         'kind': 'Secret',
@@ -151,7 +406,7 @@ def gen_network_secret(chain_name, i):
         },
         'type': 'Opaque',
         'data': {
-            'network-key': base64.b64encode(bytes(network_key, encoding='utf8')).decode('utf-8')
+            'network-key': network_key
         }
     }
     return netwok_secret
@@ -249,6 +504,15 @@ def gen_executor_service(i, chain_name, node_port, is_chaincode_executor):
     return executor_service
 
 
+# subPath of datadir is the only field of containers that differs between nodes,
+# it is left empty in templates and filled by instantiate_container
+NODE_SUBPATH = None
+
+# container: shared by all nodes of a chain, must not be modified
+# datadir_mounts: indexes of volumeMounts whose subPath is the node name
+ContainerTemplate = collections.namedtuple('ContainerTemplate', ['container', 'datadir_mounts'])
+
+
 def custom_docker_image(default_docker_image, docker_registry, docker_image_namespace):
     if all([docker_registry, docker_image_namespace]):
         return '{}:{}/{}'.format(docker_registry, docker_image_namespace, default_docker_image.split('/')[-1])
@@ -256,7 +520,201 @@ def custom_docker_image(default_docker_image, docker_registry, docker_image_name
         return default_docker_image
 
 
-def gen_node_deployment(i, service_config, chain_name, pvc_name, state_db_user, state_db_password, is_need_monitor, kms_secret_name, is_need_debug, docker_registry, docker_image_namespace):
+# sidecar containers and their key in sidecar_resources of service_config
+SIDECAR_CONTAINERS = {
+    'debug': 'debug',
+    'monitor-process': 'monitor',
+    'monitor-citacloud': 'monitor',
+    'couchdb': 'couchdb',
+    'forwarder': 'forwarder',
+    'init-keys': 'init',
+}
+
+
+# types of the volumes in service_config:
+# pvc: an existing pvc shared by all nodes, each node mounts its own subPath like datadir
+# storage_class: a pvc of its own for each node, from the storage_class
+# empty_dir: scratch space deleted with the pod, medium = "Memory" for tmpfs
+VOLUME_TYPES = ['pvc', 'storage_class', 'empty_dir']
+
+# sidecar containers whose data can be moved to a volume in sidecar_volumes, and where it is mounted
+SIDECAR_VOLUME_MOUNT_PATHS = {
+    'couchdb': '/opt/couchdb/data',
+}
+
+# volumes of the pod which service_config must not use
+RESERVED_VOLUME_NAMES = ['datadir', 'kms-key', 'network-key', 'kms-secrets', 'network-secrets']
+
+VOLUME_NAME_PATTERN = '[a-z0-9]([-a-z0-9]*[a-z0-9])?'
+
+
+# requests equal to limits, so the pod gets Guaranteed QoS when all its containers have a profile
+def gen_container_resources(service_config, profile_name):
+    profile = service_config['resource_profiles'][profile_name]
+    return {
+        'requests': dict(profile),
+        'limits': dict(profile),
+    }
+
+
+def set_containers_resources(containers, service_config):
+    profile_names = dict(service_config.get('sidecar_resources', {}))
+    # all sidecars of one key share the profile
+    profile_names = {name: profile_names.get(key) for name, key in SIDECAR_CONTAINERS.items()}
+    for service in service_config['services']:
+        profile_names[service['name']] = service.get('resources')
+    for container in containers:
+        profile_name = profile_names.get(container['name'])
+        if profile_name is not None:
+            container['resources'] = gen_container_resources(service_config, profile_name)
+
+
+# a pod is Guaranteed only if its init containers have resources too, without init in
+# sidecar_resources they take the profile of kms, whose keys they copy
+def set_init_containers_resources(containers, service_config):
+    profile_name = service_config.get('sidecar_resources', {}).get('init')
+    if profile_name is None:
+        profile_name = next((service.get('resources') for service in service_config['services'] if service['name'] == 'kms'), None)
+    if profile_name is None:
+        return
+    for container in containers:
+        container['resources'] = gen_container_resources(service_config, profile_name)
+
+
+def gen_volume_mount(service_config, volume_name, mount_path):
+    volume_mount = {
+        'name': volume_name,
+        'mountPath': mount_path,
+    }
+    # a shared pvc is divided by node like datadir
+    if service_config['volumes'][volume_name]['type'] == 'pvc':
+        volume_mount['subPath'] = NODE_SUBPATH
+    return volume_mount
+
+
+# mount the volume of each service at its mount_path, and replace the datadir of sidecars with their volume
+def set_containers_volumes(containers, service_config):
+    services = {service['name']: service for service in service_config['services']}
+    sidecar_volumes = service_config.get('sidecar_volumes', {})
+    for container in containers:
+        name = container['name']
+        if name in sidecar_volumes:
+            mount_path = SIDECAR_VOLUME_MOUNT_PATHS[name]
+            volume_mounts = [mount for mount in container['volumeMounts'] if mount['mountPath'] != mount_path]
+            volume_mounts.append(gen_volume_mount(service_config, sidecar_volumes[name], mount_path))
+            container['volumeMounts'] = volume_mounts
+        elif services.get(name, {}).get('volume') is not None:
+            service = services[name]
+            volume_mount = gen_volume_mount(service_config, service['volume'], service['mount_path'])
+            container['volumeMounts'] = container['volumeMounts'] + [volume_mount]
+
+
+def pin_image(image, digest):
+    return '{}@{}'.format(image.split('@')[0], digest)
+
+
+# image_digests is {image: digest} from the image lock, images not in it are errors
+def pin_containers_images(containers, image_digests):
+    missing = sorted(set(container['image'] for container in containers) - image_digests.keys())
+    if missing:
+        raise InvalidChainSpec('images not in image lock: {}'.format(' '.join(missing)))
+    for container in containers:
+        container['image'] = pin_image(container['image'], image_digests[container['image']])
+        container['imagePullPolicy'] = PINNED_IMAGEPULLPOLICY
+
+
+def gen_service_pvc_name(node_name, volume_name):
+    return '{}-{}'.format(node_name, volume_name)
+
+
+def gen_storage_class_pvc_spec(volume):
+    pvc_spec = {
+        'accessModes': ['ReadWriteOnce'],
+        'resources': {
+            'requests': {
+                'storage': volume['size'],
+            },
+        },
+    }
+    if volume.get('storage_class'):
+        pvc_spec['storageClassName'] = volume['storage_class']
+    return pvc_spec
+
+
+# volumes of service_config used by containers, in order of name
+def used_volumes(service_config):
+    names = [service.get('volume') for service in service_config['services']]
+    names += list(service_config.get('sidecar_volumes', {}).values())
+    volumes = service_config.get('volumes', {})
+    return [(name, volumes[name]) for name in sorted(set(names) - {None})]
+
+
+# pod volumes of a node, node_name is None for the pod template of StatefulSet,
+# where volumes of storage_class come from volumeClaimTemplates
+def gen_service_volumes(service_config, node_name):
+    pod_volumes = []
+    for name, volume in used_volumes(service_config):
+        if volume['type'] == 'pvc':
+            pod_volumes.append({
+                'name': name,
+                'persistentVolumeClaim': {
+                    'claimName': volume['claim_name'],
+                }
+            })
+        elif volume['type'] == 'storage_class':
+            if node_name is not None:
+                pod_volumes.append({
+                    'name': name,
+                    'persistentVolumeClaim': {
+                        'claimName': gen_service_pvc_name(node_name, name),
+                    }
+                })
+        else:
+            empty_dir = {}
+            if volume.get('medium'):
+                empty_dir['medium'] = volume['medium']
+            if volume.get('size_limit'):
+                empty_dir['sizeLimit'] = volume['size_limit']
+            pod_volumes.append({
+                'name': name,
+                'emptyDir': empty_dir,
+            })
+    return pod_volumes
+
+
+# pvcs of the volumes of storage_class of a node in Deployment mode
+def gen_service_pvcs(service_config, node_name):
+    pvcs = []
+    for name, volume in used_volumes(service_config):
+        if volume['type'] != 'storage_class':
+            continue
+        pvcs.append({
+            'apiVersion': 'v1',
+            'kind': 'PersistentVolumeClaim',
+            'metadata': {
+                'name': gen_service_pvc_name(node_name, name),
+            },
+            'spec': gen_storage_class_pvc_spec(volume),
+        })
+    return pvcs
+
+
+# volumeClaimTemplates of the volumes of storage_class in StatefulSet mode
+def gen_service_volume_claim_templates(service_config):
+    volume_claim_templates = []
+    for name, volume in used_volumes(service_config):
+        if volume['type'] != 'storage_class':
+            continue
+        volume_claim_templates.append({
+            'metadata': {
+                'name': name,
+            },
+            'spec': gen_storage_class_pvc_spec(volume),
+        })
+    return volume_claim_templates
+
+
+def compile_container_templates(service_config, state_db_user, state_db_password, is_need_monitor, is_need_debug, docker_registry, docker_image_namespace, image_digests=None, monitor_mode='sidecar', layout='pod', is_need_rpc_gateway=False):
     containers = []
     if is_need_debug:
         debug_container = {
@@ -279,7 +737,7 @@ def gen_node_deployment(i, service_config, chain_name, pvc_name, state_db_user,
             'volumeMounts': [
                 {
                     'name': 'datadir',
-                    'subPath': get_node_pod_name(i, chain_name),
+                    'subPath': NODE_SUBPATH,
                     'mountPath': '/data',
                 }
             ],
@@ -312,7 +770,7 @@ def gen_node_deployment(i, service_config, chain_name, pvc_name, state_db_user,
                 'volumeMounts': [
                     {
                         'name': 'datadir',
-                        'subPath': get_node_pod_name(i, chain_name),
+                        'subPath': NODE_SUBPATH,
                         'mountPath': '/data',
                     },
                     {
@@ -344,7 +802,7 @@ def gen_node_deployment(i, service_config, chain_name, pvc_name, state_db_user,
                 'volumeMounts': [
                     {
                         'name': 'datadir',
-                        'subPath': get_node_pod_name(i, chain_name),
+                        'subPath': NODE_SUBPATH,
                         'mountPath': '/data',
                     },
                 ],
@@ -371,7 +829,7 @@ def gen_node_deployment(i, service_config, chain_name, pvc_name, state_db_user,
                 'volumeMounts': [
                     {
                         'name': 'datadir',
-                        'subPath': get_node_pod_name(i, chain_name),
+                        'subPath': NODE_SUBPATH,
                         'mountPath': '/data',
                     },
                 ],
@@ -407,7 +865,7 @@ def gen_node_deployment(i, service_config, chain_name, pvc_name, state_db_user,
                         'volumeMounts': [
                             {
                                 'name': 'datadir',
-                                'subPath': get_node_pod_name(i, chain_name),
+                                'subPath': NODE_SUBPATH,
                                 'mountPath': '/opt/couchdb/data',
                             },
                         ],
@@ -452,7 +910,7 @@ def gen_node_deployment(i, service_config, chain_name, pvc_name, state_db_user,
                 'volumeMounts': [
                     {
                         'name': 'datadir',
-                        'subPath': get_node_pod_name(i, chain_name),
+                        'subPath': NODE_SUBPATH,
                         'mountPath': '/data',
                     },
                 ],
@@ -479,11 +937,13 @@ def gen_node_deployment(i, service_config, chain_name, pvc_name, state_db_user,
                 'volumeMounts': [
                     {
                         'name': 'datadir',
-                        'subPath': get_node_pod_name(i, chain_name),
+                        'subPath': NODE_SUBPATH,
                         'mountPath': '/data',
                     },
                 ],
             }
+            if is_need_rpc_gateway:
+                controller_container['readinessProbe'] = gen_rpc_readiness_probe()
             containers.append(controller_container)
         elif service['name'] == 'kms':
             kms_container = {
@@ -506,7 +966,7 @@ def gen_node_deployment(i, service_config, chain_name, pvc_name, state_db_user,
                 'volumeMounts': [
                     {
                         'name': 'datadir',
-                        'subPath': get_node_pod_name(i, chain_name),
+                        'subPath': NODE_SUBPATH,
                         'mountPath': '/data',
                     },
                     {
@@ -518,12 +978,12 @@ def gen_node_deployment(i, service_config, chain_name, pvc_name, state_db_user,
             }
             containers.append(kms_container)
         else:
-            print("unexpected service")
-            sys.exit(1)
+            raise ValueError('unexpected service: {}'.format(service['name']))
 
-    if is_need_monitor:
+    # processes of the host are watched by the exporter of process_exporter_daemonset in host mode
+    if is_need_monitor and monitor_mode == 'sidecar':
         monitor_process_container = {
-            'image': custom_docker_image('citacloud/monitor-process-exporter:0.4.1', docker_registry, docker_image_namespace),
+            'image': custom_docker_image(PROCESS_EXPORTER_DOCKER_IMAGE, docker_registry, docker_image_namespace),
             'imagePullPolicy': DEFAULT_IMAGEPULLPOLICY,
             'name': 'monitor-process',
             'ports': [
@@ -543,12 +1003,14 @@ def gen_node_deployment(i, service_config, chain_name, pvc_name, state_db_user,
             'volumeMounts': [
                 {
                     'name': 'datadir',
-                    'subPath': get_node_pod_name(i, chain_name),
+                    'subPath': NODE_SUBPATH,
                     'mountPath': '/data',
                 },
             ],
         }
         containers.append(monitor_process_container)
+    # chain data is read from the controller and the datadir of the node
+    if is_need_monitor:
         monitor_citacloud_container = {
             'image': custom_docker_image('citacloud/monitor-citacloud-exporter:0.1.1', docker_registry, docker_image_namespace),
             'imagePullPolicy': DEFAULT_IMAGEPULLPOLICY,
@@ -572,13 +1034,47 @@ def gen_node_deployment(i, service_config, chain_name, pvc_name, state_db_user,
             'volumeMounts': [
                 {
                     'name': 'datadir',
-                    'subPath': get_node_pod_name(i, chain_name),
+                    'subPath': NODE_SUBPATH,
                     'mountPath': '/data',
                 },
             ],
         }
         containers.append(monitor_citacloud_container)
+    # the command is filled for each pod by gen_forwarder_container
+    if layout == 'split':
+        forwarder_container = {
+            'image': custom_docker_image(FORWARDER_DOCKER_IMAGE, docker_registry, docker_image_namespace),
+            'imagePullPolicy': DEFAULT_IMAGEPULLPOLICY,
+            'name': 'forwarder',
+        }
+        containers.append(forwarder_container)
+
+    set_containers_resources(containers, service_config)
+    set_containers_volumes(containers, service_config)
+    if image_digests is not None:
+        pin_containers_images(containers, image_digests)
+
+    templates = []
+    for container in containers:
+        datadir_mounts = tuple(index for index, mount in enumerate(container.get('volumeMounts', [])) if 'subPath' in mount)
+        templates.append(ContainerTemplate(container, datadir_mounts))
+    return tuple(templates)
+
+
+# node_name is None for the pod template of StatefulSet, whose nodes have their own volumes
+def instantiate_container(template, node_name):
+    container = dict(template.container)
+    volume_mounts = list(container['volumeMounts'])
+    for index in template.datadir_mounts:
+        if node_name is None:
+            volume_mounts[index] = {k: v for k, v in volume_mounts[index].items() if k != 'subPath'}
+        else:
+            volume_mounts[index] = dict(volume_mounts[index], subPath=node_name)
+    container['volumeMounts'] = volume_mounts
+    return container
+
 
+def gen_node_volumes(i, service_config, chain_name, pvc_name, kms_secret_name):
     volumes = [
         {
             'name': 'kms-key',
@@ -599,13 +1095,25 @@ def gen_node_deployment(i, service_config, chain_name, pvc_name, state_db_user,
             }
         },
     ]
+    volumes += gen_service_volumes(service_config, get_node_pod_name(i, chain_name))
+    return volumes
+
+
+# pod_scheduling is the scheduling fields of pod spec from gen_pod_scheduling
+def gen_node_deployment(i, service_config, chain_name, pvc_name, state_db_user, state_db_password, is_need_monitor, kms_secret_name, is_need_debug, docker_registry, docker_image_namespace, container_templates=None, pod_scheduling=None):
+    if container_templates is None:
+        container_templates = compile_container_templates(service_config, state_db_user, state_db_password, is_need_monitor, is_need_debug, docker_registry, docker_image_namespace)
+    node_name = get_node_pod_name(i, chain_name)
+    containers = [instantiate_container(template, node_name) for template in container_templates]
+
+    volumes = gen_node_volumes(i, service_config, chain_name, pvc_name, kms_secret_name)
     deployment = {
         'apiVersion': 'apps/v1',
         'kind': 'Deployment',
         'metadata': {
-            'name': get_node_pod_name(i, chain_name),
+            'name': node_name,
             'labels': {
-                'node_name': get_node_pod_name(i, chain_name),
+                'node_name': node_name,
                 'chain_name': chain_name,
             }
         },
@@ -613,13 +1121,13 @@ def gen_node_deployment(i, service_config, chain_name, pvc_name, state_db_user,
             'replicas': 1,
             'selector': {
                 'matchLabels': {
-                    'node_name': get_node_pod_name(i, chain_name),
+                    'node_name': node_name,
                 }
             },
             'template': {
                 'metadata': {
                     'labels': {
-                        'node_name': get_node_pod_name(i, chain_name),
+                        'node_name': node_name,
                         'chain_name': chain_name,
                     }
                 },
@@ -627,6 +1135,7 @@ def gen_node_deployment(i, service_config, chain_name, pvc_name, state_db_user,
                     'shareProcessNamespace': True,
                     'containers': containers,
                     'volumes': volumes,
+                    **(pod_scheduling or {}),
                 }
             }
         }
@@ -634,6 +1143,319 @@ def gen_node_deployment(i, service_config, chain_name, pvc_name, state_db_user,
     return deployment
 
 
+def gen_split_name(node_name, service_name):
+    return '{}-{}'.format(node_name, service_name)
+
+
+def gen_split_pod_labels(node_name, service_name):
+    return {
+        'node_name': node_name,
+        'service_name': service_name,
+    }
+
+
+# the services still dial each other at localhost, the forwarder of each pod
+# sends the gRPC ports of the other services of the node to their ClusterIP services
+def gen_forwarder_container(template, node_name, service_name):
+    commands = []
+    for name in SERVICE_LIST:
+        if name == service_name:
+            continue
+        commands.append('socat TCP-LISTEN:{port},fork,reuseaddr TCP:{host}:{port}'.format(port=SERVICE_GRPC_PORTS[name], host=gen_split_name(node_name, name)))
+    # the container exits with the last one, so k8s restarts it
+    commands[-1] = 'exec ' + commands[-1]
+    container = dict(template.container)
+    container['command'] = [
+        'sh',
+        '-c',
+        ' & '.join(commands),
+    ]
+    return container
+
+
+def gen_split_cluster_ip_service(node_name, service_name):
+    cluster_ip_service = {
+        'apiVersion': 'v1',
+        'kind': 'Service',
+        'metadata': {
+            'name': gen_split_name(node_name, service_name),
+        },
+        'spec': {
+            'type': 'ClusterIP',
+            'ports': [
+                {
+                    'port': SERVICE_GRPC_PORTS[service_name],
+                    'targetPort': SERVICE_GRPC_PORTS[service_name],
+                    'name': 'grpc',
+                },
+            ],
+            'selector': gen_split_pod_labels(node_name, service_name),
+        }
+    }
+    return cluster_ip_service
+
+
+# replicas of a service, only stateless ones may have more than one
+def gen_service_replicas(service_config, service_name):
+    for service in service_config['services']:
+        if service['name'] == service_name:
+            return service.get('replicas', 1)
+    return 1
+
+
+# a Deployment and a ClusterIP service for each service of a node,
+# pods_scheduling is {service name: scheduling fields of its pods}
+def gen_split_node_objects(i, service_config, chain_name, pvc_name, kms_secret_name, container_templates, pods_scheduling=None):
+    node_name = get_node_pod_name(i, chain_name)
+    volumes = gen_node_volumes(i, service_config, chain_name, pvc_name, kms_secret_name)
+    templates = {}
+    forwarder_template = None
+    for template in container_templates:
+        name = template.container['name']
+        if name == 'forwarder':
+            forwarder_template = template
+        else:
+            templates.setdefault(SPLIT_SIDECAR_SERVICES.get(name, name), []).append(template)
+
+    k8s_config = []
+    for service_name in SERVICE_LIST:
+        containers = [instantiate_container(template, node_name) for template in templates[service_name]]
+        containers.append(gen_forwarder_container(forwarder_template, node_name, service_name))
+        mounted = set(mount['name'] for container in containers for mount in container.get('volumeMounts', []))
+        labels = dict(gen_split_pod_labels(node_name, service_name), chain_name=chain_name)
+        deployment = {
+            'apiVersion': 'apps/v1',
+            'kind': 'Deployment',
+            'metadata': {
+                'name': gen_split_name(node_name, service_name),
+                'labels': dict(labels),
+            },
+            'spec': {
+                'replicas': gen_service_replicas(service_config, service_name),
+                'selector': {
+                    'matchLabels': gen_split_pod_labels(node_name, service_name),
+                },
+                'template': {
+                    'metadata': {
+                        'labels': dict(labels),
+                    },
+                    'spec': {
+                        'containers': containers,
+                        'volumes': [volume for volume in volumes if volume['name'] in mounted],
+                        **((pods_scheduling or {}).get(service_name) or {}),
+                    }
+                }
+            }
+        }
+        k8s_config.append(deployment)
+        k8s_config.append(gen_split_cluster_ip_service(node_name, service_name))
+    return k8s_config
+
+
+def gen_chain_kms_secret(kms_passwords, secret_name):
+    data = {}
+    for i, kms_password in enumerate(kms_passwords):
+        data['key_file-{}'.format(i)] = base64.b64encode(bytes(kms_password, encoding='utf8')).decode('utf-8')
+    secret = {
+        'apiVersion': 'v1',
+        'kind': 'Secret',
+        'metadata': {
+            'name': secret_name,
+        },
+        'type': 'Opaque',
+        'data': data,
+    }
+    return secret
+
+
+def gen_chain_network_secret_name(chain_name):
+    return '{}-network-secret'.format(chain_name)
+
+
+def gen_chain_network_secret(chain_name, peers_count):
+    data = {}
+    for i in range(peers_count):
+        network_key = '0x' + os.urandom(32).hex()
+        data['network-key-{}'.format(i)] = base64.b64encode(bytes(network_key, encoding='utf8')).decode('utf-8')
+    netwok_secret = {
+        'apiVersion': 'v1',
+        'kind': 'Secret',
+        'metadata': {
+            'name': gen_chain_network_secret_name(chain_name),
+        },
+        'type': 'Opaque',
+        'data': data,
+    }
+    return netwok_secret
+
+
+# DNS name of each node is {chain_name}-{index}.{chain_name}
+def gen_headless_service(chain_name):
+    headless_service = {
+        'apiVersion': 'v1',
+        'kind': 'Service',
+        'metadata': {
+            'name': chain_name,
+        },
+        'spec': {
+            'clusterIP': 'None',
+            # peers must find each other before they are ready
+            'publishNotReadyAddresses': True,
+            'ports': [
+                {
+                    'port': 40000,
+                    'targetPort': 40000,
+                    'name': 'network',
+                },
+            ],
+            'selector': {
+                'chain_name': chain_name,
+            }
+        }
+    }
+    return headless_service
+
+
+# copy the keys of this pod from the secrets of the chain, ordinal of pod is the suffix of its hostname
+def gen_init_keys_container(docker_registry, docker_image_namespace):
+    init_keys_container = {
+        'image': custom_docker_image(INIT_DOCKER_IMAGE, docker_registry, docker_image_namespace),
+        'imagePullPolicy': DEFAULT_IMAGEPULLPOLICY,
+        'name': 'init-keys',
+        'command': [
+            'sh',
+            '-c',
+            'ordinal=${HOSTNAME##*-} && '
+            'cp /secrets/kms/key_file-$ordinal /kms/key_file && '
+            'cp /secrets/network/network-key-$ordinal /network/network-key',
+        ],
+        'volumeMounts': [
+            {
+                'name': 'kms-secrets',
+                'mountPath': '/secrets/kms',
+                'readOnly': True,
+            },
+            {
+                'name': 'network-secrets',
+                'mountPath': '/secrets/network',
+                'readOnly': True,
+            },
+            {
+                'name': 'kms-key',
+                'mountPath': '/kms',
+            },
+            {
+                'name': 'network-key',
+                'mountPath': '/network',
+            },
+        ],
+    }
+    return init_keys_container
+
+
+# name of the pvc which volumeClaimTemplates of StatefulSet creates for node i
+def gen_statefulset_pvc_name(chain_name, i):
+    return 'datadir-{}'.format(get_node_pod_name(i, chain_name))
+
+
+# name of the pvc of node i, created by `create_pvc.py node_pvc` for Deployment mode
+def gen_node_pvc_name(chain_name, i):
+    return '{}-pvc'.format(get_node_pod_name(i, chain_name))
+
+
+def gen_volume_claim_template(storage_class, storage_size):
+    volume_claim_template = {
+        'metadata': {
+            'name': 'datadir',
+        },
+        'spec': {
+            'accessModes': ['ReadWriteOnce'],
+            'resources': {
+                'requests': {
+                    'storage': storage_size,
+                },
+            },
+        },
+    }
+    if storage_class:
+        volume_claim_template['spec']['storageClassName'] = storage_class
+    return volume_claim_template
+
+
+def gen_statefulset(chain_name, peers_count, service_config, container_templates, storage_class, storage_size, docker_registry, docker_image_namespace, pod_scheduling=None, image_digests=None):
+    containers = [instantiate_container(template, None) for template in container_templates]
+    init_keys_container = gen_init_keys_container(docker_registry, docker_image_namespace)
+    set_init_containers_resources([init_keys_container], service_config)
+    if image_digests is not None:
+        pin_containers_images([init_keys_container], image_digests)
+
+    volumes = [
+        {
+            'name': 'kms-secrets',
+            'secret': {
+                'secretName': gen_kms_secret_name(chain_name)
+            }
+        },
+        {
+            'name': 'network-secrets',
+            'secret': {
+                'secretName': gen_chain_network_secret_name(chain_name)
+            }
+        },
+        # keys of this node, written by init-keys
+        {
+            'name': 'kms-key',
+            'emptyDir': {
+                'medium': 'Memory',
+            }
+        },
+        {
+            'name': 'network-key',
+            'emptyDir': {
+                'medium': 'Memory',
+            }
+        },
+    ]
+    volumes += gen_service_volumes(service_config, None)
+    statefulset = {
+        'apiVersion': 'apps/v1',
+        'kind': 'StatefulSet',
+        'metadata': {
+            'name': chain_name,
+            'labels': {
+                'chain_name': chain_name,
+            }
+        },
+        'spec': {
+            'serviceName': chain_name,
+            'replicas': peers_count,
+            # nodes are peers, start them all at once
+            'podManagementPolicy': 'Parallel',
+            'selector': {
+                'matchLabels': {
+                    'chain_name': chain_name,
+                }
+            },
+            'template': {
+                'metadata': {
+                    'labels': {
+                        'chain_name': chain_name,
+                    }
+                },
+                'spec': {
+                    'shareProcessNamespace': True,
+                    'initContainers': [init_keys_container],
+                    'containers': containers,
+                    'volumes': volumes,
+                    **(pod_scheduling or {}),
+                }
+            },
+            'volumeClaimTemplates': [gen_volume_claim_template(storage_class, storage_size)] + gen_service_volume_claim_templates(service_config),
+        }
+    }
+    return statefulset
+
+
 def find_docker_image(service_config, service_name):
     for service in service_config['services']:
         if service['name'] == service_name:
@@ -641,18 +1463,110 @@ def find_docker_image(service_config, service_name):
 
 
 def load_service_config(service_config):
+    import toml
     return toml.load(service_config)
 
 
+# keys of each service in service_config which must be strings
+SERVICE_REQUIRED_KEYS = ['name', 'docker_image', 'cmd']
+SERVICE_OPTIONAL_KEYS = ['resources', 'volume', 'mount_path']
+
+# tables of service_config besides services
+SERVICE_CONFIG_TABLES = ['resource_profiles', 'sidecar_resources', 'volumes', 'sidecar_volumes']
+
+
+def verify_service_config_types(service_config):
+    if not isinstance(service_config.get('services'), list):
+        raise InvalidChainSpec('services must be an array of tables')
+    for index, service in enumerate(service_config['services']):
+        if not isinstance(service, dict):
+            raise InvalidChainSpec('service {} must be a table'.format(index))
+        for key in SERVICE_REQUIRED_KEYS:
+            if not isinstance(service.get(key), str) or not service[key]:
+                raise InvalidChainSpec('{} of service {} must be a non-empty string'.format(key, service.get('name', index)))
+        for key in SERVICE_OPTIONAL_KEYS:
+            if service.get(key) is not None and not isinstance(service[key], str):
+                raise InvalidChainSpec('{} of service {} must be a string'.format(key, service['name']))
+    for key in SERVICE_CONFIG_TABLES:
+        if not isinstance(service_config.get(key, {}), dict):
+            raise InvalidChainSpec('{} must be a table'.format(key))
+
+
 def verify_service_config(service_config):
+    verify_service_config_types(service_config)
     indexs = 1
     for service in service_config['services']:
+        if service['name'] not in SERVICE_LIST:
+            raise InvalidChainSpec('unexpected service: {}'.format(service['name']))
         index = (SERVICE_LIST.index(service['name']) + 1) * 10
         indexs *= index
 
     if indexs != 10 * 20 * 30 * 40 * 50 * 60:
-        print('There must be 6 services:', SERVICE_LIST)
-        sys.exit(1)
+        raise InvalidChainSpec('There must be 6 services: {}'.format(SERVICE_LIST))
+
+    verify_resource_profiles(service_config)
+    verify_volumes(service_config)
+    verify_replicas(service_config)
+
+
+# several pods of a service share the datadir of the node, so only stateless ones can have replicas
+def verify_replicas(service_config):
+    for service in service_config['services']:
+        replicas = service.get('replicas', 1)
+        if not isinstance(replicas, int) or isinstance(replicas, bool) or replicas < 1:
+            raise InvalidChainSpec('replicas of {} must be a positive integer'.format(service['name']))
+        if not isinstance(service.get('stateless', False), bool):
+            raise InvalidChainSpec('stateless of {} must be true or false'.format(service['name']))
+        if replicas > 1 and not service.get('stateless', False):
+            raise InvalidChainSpec('{} has {} replicas but is not stateless'.format(service['name'], replicas))
+
+
+def verify_resource_profiles(service_config):
+    profiles = service_config.get('resource_profiles', {})
+    for name, profile in profiles.items():
+        if not isinstance(profile, dict) or not profile:
+            raise InvalidChainSpec('resource profile {} must be a table of resources like cpu and memory'.format(name))
+    sidecar_resources = service_config.get('sidecar_resources', {})
+    for key in sidecar_resources:
+        if key not in SIDECAR_CONTAINERS.values():
+            raise InvalidChainSpec('unexpected sidecar in sidecar_resources: {}'.format(key))
+    references = [(service['name'], service.get('resources')) for service in service_config['services']]
+    references += list(sidecar_resources.items())
+    for name, profile_name in references:
+        if profile_name is not None and profile_name not in profiles:
+            raise InvalidChainSpec('unknown resource profile of {}: {}'.format(name, profile_name))
+
+
+def verify_volumes(service_config):
+    volumes = service_config.get('volumes', {})
+    for name, volume in volumes.items():
+        if not re.fullmatch(VOLUME_NAME_PATTERN, name) or name in RESERVED_VOLUME_NAMES:
+            raise InvalidChainSpec('invalid volume name {}, should be a DNS label other than {}'.format(name, RESERVED_VOLUME_NAMES))
+        if not isinstance(volume, dict) or volume.get('type') not in VOLUME_TYPES:
+            raise InvalidChainSpec('type of volume {} must be one of {}'.format(name, VOLUME_TYPES))
+        if volume['type'] == 'pvc' and not volume.get('claim_name'):
+            raise InvalidChainSpec('claim_name is required by volume {} of type pvc'.format(name))
+        if volume['type'] == 'storage_class' and not volume.get('size'):
+            raise InvalidChainSpec('size is required by volume {} of type storage_class'.format(name))
+    sidecar_volumes = service_config.get('sidecar_volumes', {})
+    for key in sidecar_volumes:
+        if key not in SIDECAR_VOLUME_MOUNT_PATHS:
+            raise InvalidChainSpec('unexpected sidecar in sidecar_volumes: {}'.format(key))
+    references = [(service['name'], service.get('volume')) for service in service_config['services']]
+    references += list(sidecar_volumes.items())
+    used = {}
+    for name, volume_name in references:
+        if volume_name is None:
+            continue
+        if volume_name not in volumes:
+            raise InvalidChainSpec('unknown volume of {}: {}'.format(name, volume_name))
+        # a volume of its own for each service, so that they do not share the I/O
+        if volume_name in used:
+            raise InvalidChainSpec('volume {} is used by both {} and {}'.format(volume_name, used[volume_name], name))
+        used[volume_name] = name
+    for service in service_config['services']:
+        if service.get('volume') is not None and not str(service.get('mount_path', '')).startswith('/'):
+            raise InvalidChainSpec('mount_path of {} must be an absolute path'.format(service['name']))
 
 
 def gen_kms_secret_name(chain_name):
@@ -664,58 +1578,475 @@ def gen_peers_net_addr(nodes, node_ports):
     return list(map(lambda ip, port: {'ip': ip, 'port': port}, nodes, node_ports))
 
 
-def gen_all_service(i, chain_name, node_port, token, is_need_monitor, is_need_debug, is_chaincode_executor):
+# offset from the start port of a node of each port in all service
+NODE_PORT_OFFSETS = {
+    'network': 0,
+    'debug': 1,
+    'rpc': 2,
+    'call': 3,
+    'process': 4,
+    'exporter': 5,
+    'chaincode': 6,
+    'eventhub': 7,
+}
+
+
+def gen_node_port_names(is_need_monitor, is_need_debug, is_chaincode_executor):
+    names = ['network', 'rpc', 'call']
+    if is_need_monitor:
+        names += ['process', 'exporter']
+    if is_chaincode_executor:
+        names += ['chaincode', 'eventhub']
+    if is_need_debug:
+        names.append('debug')
+    return names
+
+
+# count of ports from the start port of a node to its last port
+def gen_node_port_span(is_need_monitor, is_need_debug, is_chaincode_executor):
+    names = gen_node_port_names(is_need_monitor, is_need_debug, is_chaincode_executor)
+    return max(NODE_PORT_OFFSETS[name] for name in names) + 1
+
+
+# pull the images of the nodes with init containers, so pods of the nodes start without pulling.
+# Images may have no shell, so the first init container copies the static busybox of the
+# init-keys image into a volume, and the init container of each image runs `busybox true` from it.
+def gen_prepull_daemonset(chain_name, container_templates, docker_registry, docker_image_namespace, image_digests=None):
+    copy_container = {
+        'image': custom_docker_image(INIT_DOCKER_IMAGE, docker_registry, docker_image_namespace),
+        'imagePullPolicy': DEFAULT_IMAGEPULLPOLICY,
+        'name': 'prepull-busybox',
+        'command': [
+            'cp',
+            '/bin/busybox',
+            '{}/busybox'.format(PREPULL_BIN_PATH),
+        ],
+        'volumeMounts': [
+            {
+                'name': 'prepull-bin',
+                'mountPath': PREPULL_BIN_PATH,
+            },
+        ],
+    }
+    if image_digests is not None:
+        pin_containers_images([copy_container], image_digests)
+    images = []
+    for template in container_templates:
+        if template.container['image'] not in images and template.container['image'] != copy_container['image']:
+            images.append(template.container['image'])
+    init_containers = [copy_container]
+    for index, image in enumerate(images):
+        init_containers.append({
+            'image': image,
+            'imagePullPolicy': container_templates[0].container['imagePullPolicy'],
+            'name': 'prepull-{}'.format(index),
+            'command': [
+                '{}/busybox'.format(PREPULL_BIN_PATH),
+                'true',
+            ],
+            'volumeMounts': [
+                {
+                    'name': 'prepull-bin',
+                    'mountPath': PREPULL_BIN_PATH,
+                    'readOnly': True,
+                },
+            ],
+        })
+    pause_container = {
+        'image': custom_docker_image(PAUSE_DOCKER_IMAGE, docker_registry, docker_image_namespace),
+        'imagePullPolicy': DEFAULT_IMAGEPULLPOLICY,
+        'name': 'pause',
+    }
+    if image_digests is not None:
+        pin_containers_images([pause_container], image_digests)
+    name = '{}-prepull'.format(chain_name)
+    prepull_daemonset = {
+        'apiVersion': 'apps/v1',
+        'kind': 'DaemonSet',
+        'metadata': {
+            'name': name,
+            'labels': {
+                'chain_name': chain_name,
+            }
+        },
+        'spec': {
+            'selector': {
+                'matchLabels': {
+                    'prepull': name,
+                }
+            },
+            'template': {
+                'metadata': {
+                    'labels': {
+                        'prepull': name,
+                    }
+                },
+                'spec': {
+                    'initContainers': init_containers,
+                    'containers': [pause_container],
+                    'volumes': [
+                        {
+                            'name': 'prepull-bin',
+                            'emptyDir': {},
+                        },
+                    ],
+                }
+            }
+        }
+    }
+    return prepull_daemonset
+
+
+# processes of every chain on the host are grouped by command name and cgroup,
+# the cgroup path of a container has the UID of its pod, which the scrape config takes out
+def gen_process_list_config_map():
+    import yaml
+    process_list = {
+        'process_names': [
+            {
+                'name': '{{.Comm}};{{.Cgroups}}',
+                'comm': SERVICE_LIST,
+            },
+        ],
+    }
+    process_list_config_map = {
+        'apiVersion': 'v1',
+        'kind': 'ConfigMap',
+        'metadata': {
+            'name': PROCESS_EXPORTER_NAME,
+        },
+        'data': {
+            'process_list.yml': yaml.dump(process_list, sort_keys=False),
+            'scrape-configs.yml': yaml.dump([gen_process_scrape_job()], sort_keys=False),
+        },
+    }
+    return process_list_config_map
+
+
+# one exporter on each host sees the processes of all nodes of all chains on it by host PID namespace;
+# its pods are labeled process_exporter instead of chain_name, so selectors of nodes never match them.
+# It takes no settings of any chain, so every chain in host mode generates the same objects.
+def gen_process_exporter_daemonset():
+    process_exporter_container = {
+        'image': HOST_PROCESS_EXPORTER_DOCKER_IMAGE,
+        'imagePullPolicy': DEFAULT_IMAGEPULLPOLICY,
+        'name': 'monitor-process',
+        'ports': [
+            {
+                'containerPort': 9256,
+                'protocol': 'TCP',
+                'name': 'process',
+            }
+        ],
+        'args': [
+            '--procfs',
+            '/proc',
+            '--config.path',
+            '/config/process_list.yml'
+        ],
+        'volumeMounts': [
+            {
+                'name': 'process-list',
+                'mountPath': '/config',
+                'readOnly': True,
+            },
+        ],
+    }
+    process_exporter_daemonset = {
+        'apiVersion': 'apps/v1',
+        'kind': 'DaemonSet',
+        'metadata': {
+            'name': PROCESS_EXPORTER_NAME,
+            'labels': {
+                'process_exporter': PROCESS_EXPORTER_NAME,
+            }
+        },
+        'spec': {
+            'selector': {
+                'matchLabels': {
+                    'process_exporter': PROCESS_EXPORTER_NAME,
+                }
+            },
+            'template': {
+                'metadata': {
+                    'labels': {
+                        'process_exporter': PROCESS_EXPORTER_NAME,
+                    }
+                },
+                'spec': {
+                    'hostPID': True,
+                    'containers': [process_exporter_container],
+                    'volumes': [
+                        {
+                            'name': 'process-list',
+                            'configMap': {
+                                'name': PROCESS_EXPORTER_NAME,
+                            }
+                        },
+                    ],
+                }
+            }
+        }
+    }
+    return process_exporter_daemonset
+
+
+# objects shared by all chains in host mode, in a file of their own which no chain owns
+def gen_process_exporter_k8s_config():
+    return [gen_process_list_config_map(), gen_process_exporter_daemonset()]
+
+
+def gen_process_exporter_yaml_path(work_dir):
+    return os.path.join(work_dir, '{}.yaml'.format(PROCESS_EXPORTER_NAME))
+
+
+def write_process_exporter(spec, work_dir, writer):
+    if not spec.need_monitor or spec.monitor_mode != 'host':
+        return
+    path = gen_process_exporter_yaml_path(work_dir)
+    if writer.use_cache:
+        print("yaml_ptah:{}", path)
+    writer.write(path, dump_k8s_config(gen_process_exporter_k8s_config()))
+
+
+# keep the targets whose pod label and container port name match
+def gen_scrape_job(job_name, label, value, port_name, relabel_configs):
+    return {
+        'job_name': job_name,
+        'kubernetes_sd_configs': [
+            {
+                'role': 'pod',
+            },
+        ],
+        'relabel_configs': [
+            {
+                'source_labels': ['__meta_kubernetes_pod_label_{}'.format(label)],
+                'regex': value,
+                'action': 'keep',
+            },
+            {
+                'source_labels': ['__meta_kubernetes_pod_container_port_name'],
+                'regex': port_name,
+                'action': 'keep',
+            },
+        ] + relabel_configs,
+    }
+
+
+# groupname of the shared process exporter is split into the command name and pod_uid,
+# which kube_pod_info of kube-state-metrics maps to the pod, and its labels to the chain and node
+def gen_process_scrape_job():
+    process_scrape_job = gen_scrape_job('citacloud-process', 'process_exporter', PROCESS_EXPORTER_NAME, 'process', [
+        {
+            'source_labels': ['__meta_kubernetes_pod_node_name'],
+            'target_label': 'host',
+        },
+    ])
+    process_scrape_job['metric_relabel_configs'] = [
+        # the cgroup driver of systemd writes the UID with _ instead of -
+        {
+            'source_labels': ['groupname'],
+            'regex': '.*pod([0-9a-f]{8})[-_]([0-9a-f]{4})[-_]([0-9a-f]{4})[-_]([0-9a-f]{4})[-_]([0-9a-f]{12}).*',
+            'target_label': 'pod_uid',
+            'replacement': '$1-$2-$3-$4-$5',
+        },
+        {
+            'source_labels': ['groupname'],
+            'regex': '([^;]*);.*',
+            'target_label': 'groupname',
+        },
+        # processes of the same name outside of pods
+        {
+            'source_labels': ['groupname', 'pod_uid'],
+            'regex': '.+;',
+            'action': 'drop',
+        },
+    ]
+    return process_scrape_job
+
+
+# scrape_configs of prometheus, which find the exporter of chain data by labels of pods,
+# the job of the shared process exporter is in its own ConfigMap
+def gen_scrape_config_map(chain_name):
+    import yaml
+    scrape_configs = [
+        gen_scrape_job('{}-citacloud'.format(chain_name), 'chain_name', chain_name, 'exporter', [
+            {
+                'source_labels': ['__meta_kubernetes_pod_name'],
+                'target_label': 'node',
+            },
+            # pods of Deployment have a random suffix, use their node_name
+            {
+                'source_labels': ['__meta_kubernetes_pod_label_node_name'],
+                'regex': '(.+)',
+                'target_label': 'node',
+            },
+            {
+                'source_labels': ['__meta_kubernetes_pod_node_name'],
+                'target_label': 'host',
+            },
+        ]),
+    ]
+    scrape_config_map = {
+        'apiVersion': 'v1',
+        'kind': 'ConfigMap',
+        'metadata': {
+            'name': '{}-scrape-configs'.format(chain_name),
+        },
+        'data': {
+            'scrape-configs.yml': yaml.dump(scrape_configs, sort_keys=False),
+        },
+    }
+    return scrape_config_map
+
+
+# service_name selects the pods of one service in split layout
+def gen_chain_pod_selector(chain_name, service_name=None):
+    match_labels = {
+        'chain_name': chain_name,
+    }
+    if service_name is not None:
+        match_labels['service_name'] = service_name
+    return {
+        'matchLabels': match_labels,
+    }
+
+
+# scheduling fields of the pod spec of each node, so that one host failure takes down as few nodes as possible,
+# in split layout pods of the same service avoid each other
+def gen_pod_scheduling(chain_name, anti_affinity, topology_spread, topology_key, priority_class, service_name=None):
+    pod_scheduling = {}
+    pod_affinity_term = {
+        'labelSelector': gen_chain_pod_selector(chain_name, service_name),
+        'topologyKey': topology_key,
+    }
+    if anti_affinity == 'required':
+        pod_scheduling['affinity'] = {
+            'podAntiAffinity': {
+                'requiredDuringSchedulingIgnoredDuringExecution': [pod_affinity_term],
+            }
+        }
+    elif anti_affinity == 'preferred':
+        pod_scheduling['affinity'] = {
+            'podAntiAffinity': {
+                'preferredDuringSchedulingIgnoredDuringExecution': [
+                    {
+                        'weight': 100,
+                        'podAffinityTerm': pod_affinity_term,
+                    },
+                ],
+            }
+        }
+    if topology_spread:
+        pod_scheduling['topologySpreadConstraints'] = [
+            {
+                'maxSkew': 1,
+                'topologyKey': topology_key,
+                'whenUnsatisfiable': 'DoNotSchedule',
+                'labelSelector': gen_chain_pod_selector(chain_name, service_name),
+            },
+        ]
+    if priority_class:
+        pod_scheduling['priorityClassName'] = priority_class
+    return pod_scheduling
+
+
+# BFT chain of n nodes tolerates f = (n - 1) // 3 faulty nodes, n - f nodes (2f+1 when n = 3f+1) must be up
+def gen_quorum_size(peers_count):
+    return peers_count - (peers_count - 1) // 3
+
+
+# in split layout there is one for each service, whose nodes run replicas pods each
+def gen_pod_disruption_budget(chain_name, peers_count, service_name=None, replicas=1):
+    name = chain_name if service_name is None else '{}-{}'.format(chain_name, service_name)
+    pod_disruption_budget = {
+        'apiVersion': 'policy/v1',
+        'kind': 'PodDisruptionBudget',
+        'metadata': {
+            'name': '{}-pdb'.format(name),
+            'labels': {
+                'chain_name': chain_name,
+            }
+        },
+        'spec': {
+            'minAvailable': gen_quorum_size(peers_count) * replicas,
+            'selector': gen_chain_pod_selector(chain_name, service_name),
+        }
+    }
+    return pod_disruption_budget
+
+
+def gen_priority_class(name, value):
+    priority_class = {
+        'apiVersion': 'scheduling.k8s.io/v1',
+        'kind': 'PriorityClass',
+        'metadata': {
+            'name': name,
+        },
+        'value': value,
+        'globalDefault': False,
+        'description': 'Nodes of cita-cloud chains.',
+    }
+    return priority_class
+
+
+# selector is the node_name label of Deployment by default
+def gen_all_service_ports(node_port, is_need_monitor, is_need_debug, is_chaincode_executor):
     ports = [
         {
-            'port': node_port,
+            'port': node_port + NODE_PORT_OFFSETS['network'],
             'targetPort': 40000,
             'name': 'network',
         },
         {
-            'port': node_port + 2,
+            'port': node_port + NODE_PORT_OFFSETS['rpc'],
             'targetPort': 50004,
             'name': 'rpc',
         },
         {
-            'port': node_port + 3,
+            'port': node_port + NODE_PORT_OFFSETS['call'],
             'targetPort': 50002,
             'name': 'call',
         },
     ]
     if is_need_monitor:
         process_port = {
-            'port': node_port + 4,
+            'port': node_port + NODE_PORT_OFFSETS['process'],
             'targetPort': 9256,
             'name': 'process',
         }
         ports.append(process_port)
         exporter_port = {
-            'port': node_port + 5,
+            'port': node_port + NODE_PORT_OFFSETS['exporter'],
             'targetPort': 9349,
             'name': 'exporter',
         }
         ports.append(exporter_port)
     if is_chaincode_executor:
         chaincode_port = {
-            'port': node_port + 6,
+            'port': node_port + NODE_PORT_OFFSETS['chaincode'],
             'targetPort': 7052,
             'name': 'chaincode',
         }
         ports.append(chaincode_port)
         eventhub_port = {
-            'port': node_port + 7,
+            'port': node_port + NODE_PORT_OFFSETS['eventhub'],
             'targetPort': 7053,
             'name': 'eventhub',
         }
         ports.append(eventhub_port)
     if is_need_debug:
         debug_port = {
-            'port': node_port + 1,
+            'port': node_port + NODE_PORT_OFFSETS['debug'],
             'targetPort': 9999,
             'name': 'debug',
         }
         ports.append(debug_port)
-    all_service = {
+    return ports
+
+
+def gen_load_balancer_service(name, token, ports, selector):
+    load_balancer_service = {
         'apiVersion': 'v1',
         'kind': 'Service',
         'metadata': {
@@ -724,79 +2055,926 @@ def gen_all_service(i, chain_name, node_port, token, is_need_monitor, is_need_de
                 'service.beta.kubernetes.io/alicloud-loadbalancer-force-override-listeners': 'true',
                 'service.beta.kubernetes.io/alibaba-cloud-loadbalancer-health-check-interval': "50"
             },
-            'name': 'all-{}-{}'.format(chain_name, i)
+            'name': name
         },
         'spec': {
             'type': 'LoadBalancer',
             'ports': ports,
-            'selector': {
-                'node_name': get_node_pod_name(i, chain_name)
-            }
+            'selector': selector
         }
     }
-    return all_service
+    return load_balancer_service
+
+
+def gen_all_service(i, chain_name, node_port, token, is_need_monitor, is_need_debug, is_chaincode_executor, selector=None):
+    ports = gen_all_service_ports(node_port, is_need_monitor, is_need_debug, is_chaincode_executor)
+    return gen_load_balancer_service('all-{}-{}'.format(chain_name, i), token, ports, selector or {
+        'node_name': get_node_pod_name(i, chain_name)
+    })
+
+
+# in split layout the ports of a node are served by the pods of different services,
+# a service for each of them shares the load balancer of the node
+def gen_split_all_services(i, chain_name, node_port, token, is_need_monitor, is_need_debug, is_chaincode_executor):
+    node_name = get_node_pod_name(i, chain_name)
+    ports_of_services = {}
+    for port in gen_all_service_ports(node_port, is_need_monitor, is_need_debug, is_chaincode_executor):
+        ports_of_services.setdefault(SPLIT_PORT_SERVICES[port['name']], []).append(port)
+    all_services = []
+    for service_name in SERVICE_LIST:
+        if service_name in ports_of_services:
+            all_services.append(gen_load_balancer_service('all-{}-{}-{}'.format(chain_name, i, service_name), token, ports_of_services[service_name], gen_split_pod_labels(node_name, service_name)))
+    return all_services
 
 
 def gen_kms_secret_name_mc(chain_name, i):
     return 'kms-secret-{}-{}'.format(chain_name, i)
 
 
-def run_operator(args, work_dir):
-    # load service_config
-    service_config = load_service_config(args.service_config)
-    print("service_config:", service_config)
+def split_list(value, name):
+    if value is None:
+        raise InvalidChainSpec('--{} is required'.format(name))
+    return value.split(',')
+
+
+# command line arguments which can be set in a chain spec file
+CHAIN_SPEC_FILE_KEYS = [
+    'chain_name',
+    'service_config',
+    'kms_passwords',
+    'lbs_tokens',
+    'node_ports',
+    'pvc_names',
+    'need_debug',
+    'need_monitor',
+    'monitor_mode',
+    'layout',
+    'state_db_user',
+    'state_db_password',
+    'docker_registry',
+    'docker_image_namespace',
+    'statefulset',
+    'storage_class',
+    'storage_size',
+    'anti_affinity',
+    'topology_spread',
+    'topology_key',
+    'pdb',
+    'priority_class',
+    'priority_value',
+    'rpc_gateway',
+    'rpc_gateway_port',
+    'session_affinity',
+    'session_affinity_timeout',
+    'image_lock',
+    'prepull',
+]
 
-    # verify service_config
-    verify_service_config(service_config)
 
-    lbs_tokens = args.lbs_tokens.split(',')
-    kms_passwords = args.kms_passwords.split(',')
-    node_ports = list(map(lambda x : int(x), args.node_ports.split(',')))
-    pvc_names = args.pvc_names.split(',')
+# values in a chain spec file are checked like the command line arguments of the same key
+def parse_spec_file_value(action, value):
+    if isinstance(value, list):
+        if not all(isinstance(v, (str, int)) and not isinstance(v, bool) for v in value):
+            raise ValueError('expected an array of strings or numbers')
+        value = ','.join(str(v) for v in value)
+    if isinstance(value, bool):
+        if action.type is not str_to_bool:
+            raise ValueError('expected a {}, got a boolean'.format('number' if action.type is int else 'string'))
+        return value
+    if isinstance(value, int) and action.type is int:
+        pass
+    elif isinstance(value, str):
+        if action.type is not None:
+            value = action.type(value)
+    else:
+        raise ValueError('unexpected {} value {!r}'.format(type(value).__name__, value))
+    if action.choices is not None and value not in action.choices:
+        raise ValueError('expected one of {}'.format(', '.join(action.choices)))
+    return value
+
+
+@dataclasses.dataclass
+class ChainSpec:
+    """Everything needed to generate the k8s config of a chain.
+
+    The per node lists are in order of node index, one item for each node.
+    pvc_names is empty when statefulset is set.
+    """
+    chain_name: str
+    services: List[dict]
+    kms_passwords: List[str]
+    lbs_tokens: List[str]
+    node_ports: List[int]
+    pvc_names: List[str]
+    need_debug: bool = False
+    need_monitor: bool = False
+    monitor_mode: str = 'sidecar'
+    layout: str = 'pod'
+    state_db_user: str = 'citacloud'
+    state_db_password: str = 'citacloud'
+    docker_registry: Optional[str] = None
+    docker_image_namespace: Optional[str] = None
+    resource_profiles: Dict[str, dict] = dataclasses.field(default_factory=dict)
+    sidecar_resources: Dict[str, str] = dataclasses.field(default_factory=dict)
+    volumes: Dict[str, dict] = dataclasses.field(default_factory=dict)
+    sidecar_volumes: Dict[str, str] = dataclasses.field(default_factory=dict)
+    statefulset: bool = False
+    storage_class: Optional[str] = None
+    storage_size: str = '10Gi'
+    anti_affinity: str = 'none'
+    topology_spread: bool = False
+    topology_key: str = DEFAULT_TOPOLOGY_KEY
+    pdb: bool = False
+    priority_class: Optional[str] = None
+    priority_value: int = DEFAULT_PRIORITY_VALUE
+    rpc_gateway: bool = False
+    rpc_gateway_port: Optional[int] = None
+    session_affinity: str = 'None'
+    session_affinity_timeout: int = DEFAULT_SESSION_AFFINITY_TIMEOUT
+    image_digests: Optional[Dict[str, str]] = None
+    prepull: bool = False
+
+    @classmethod
+    def from_args(cls, args) -> 'ChainSpec':
+        # check the arguments before loading service_config, so that bad input fails fast
+        kms_passwords = split_list(args.kms_passwords, 'kms_passwords')
+        lbs_tokens = split_list(args.lbs_tokens, 'lbs_tokens')
+        # left empty to be allocated by port_allocator
+        node_ports = []
+        if args.node_ports is not None:
+            try:
+                node_ports = list(map(lambda x : int(x), split_list(args.node_ports, 'node_ports')))
+            except ValueError as e:
+                raise InvalidChainSpec('The node_ports is invalid: {}'.format(e))
+        # nodes of StatefulSet get volumes from volumeClaimTemplates
+        pvc_names = []
+        if not args.statefulset or args.pvc_names is not None:
+            pvc_names = split_list(args.pvc_names, 'pvc_names')
+        try:
+            service_config = load_service_config(args.service_config)
+        except (OSError, ValueError) as e:
+            raise InvalidChainSpec('load service_config {} failed: {}'.format(args.service_config, e))
+        image_digests = None
+        if args.image_lock:
+            from image_lock import load_image_lock
+            image_digests = load_image_lock(args.image_lock)
+        return cls(
+            chain_name=args.chain_name,
+            services=service_config.get('services', []),
+            kms_passwords=kms_passwords,
+            lbs_tokens=lbs_tokens,
+            node_ports=node_ports,
+            pvc_names=pvc_names,
+            need_debug=args.need_debug,
+            need_monitor=args.need_monitor,
+            monitor_mode=args.monitor_mode,
+            layout=args.layout,
+            state_db_user=args.state_db_user,
+            state_db_password=args.state_db_password,
+            docker_registry=args.docker_registry,
+            docker_image_namespace=args.docker_image_namespace,
+            resource_profiles=service_config.get('resource_profiles', {}),
+            sidecar_resources=service_config.get('sidecar_resources', {}),
+            volumes=service_config.get('volumes', {}),
+            sidecar_volumes=service_config.get('sidecar_volumes', {}),
+            statefulset=args.statefulset,
+            storage_class=args.storage_class,
+            storage_size=args.storage_size,
+            anti_affinity=args.anti_affinity,
+            topology_spread=args.topology_spread,
+            topology_key=args.topology_key,
+            pdb=args.pdb,
+            priority_class=args.priority_class,
+            priority_value=args.priority_value,
+            rpc_gateway=args.rpc_gateway,
+            rpc_gateway_port=args.rpc_gateway_port,
+            session_affinity=args.session_affinity,
+            session_affinity_timeout=args.session_affinity_timeout,
+            image_digests=image_digests,
+            prepull=args.prepull,
+        )
+
+    @classmethod
+    def from_file(cls, path) -> 'ChainSpec':
+        """Load spec from a toml or yaml file.
+
+        Keys are same as the command line arguments, lists can also be written as arrays.
+        A relative service_config is relative to the directory of the spec file.
+        """
+        return cls.from_args(cls.args_from_file(path))
+
+    @staticmethod
+    def args_from_file(path) -> argparse.Namespace:
+        """Command line arguments of a spec file, with the paths in it made absolute."""
+        import toml
+        import yaml
+        try:
+            with open(path, 'rt') as stream:
+                if path.endswith('.toml'):
+                    data = toml.load(stream)
+                else:
+                    data = yaml.safe_load(stream)
+        except (OSError, ValueError, yaml.YAMLError) as e:
+            raise InvalidChainSpec('load chain spec {} failed: {}'.format(path, e))
+        if not isinstance(data, dict):
+            raise InvalidChainSpec('chain spec {} is not a mapping'.format(path))
+
+        parser = gen_argument_parser()
+        actions = {action.dest: action for action in parser._actions}
+        args = parser.parse_args([])
+        for key, value in data.items():
+            if key not in CHAIN_SPEC_FILE_KEYS:
+                raise InvalidChainSpec('unexpected key {} in chain spec {}'.format(key, path))
+            try:
+                value = parse_spec_file_value(actions[key], value)
+            except (ValueError, TypeError) as e:
+                raise InvalidChainSpec('invalid {} in chain spec {}: {}'.format(key, path, e))
+            setattr(args, key, value)
+        args.service_config = os.path.join(os.path.dirname(os.path.abspath(path)), args.service_config)
+        if args.image_lock:
+            args.image_lock = os.path.join(os.path.dirname(os.path.abspath(path)), args.image_lock)
+        return args
+
+    @property
+    def service_config(self) -> dict:
+        return {
+            'services': self.services,
+            'resource_profiles': self.resource_profiles,
+            'sidecar_resources': self.sidecar_resources,
+            'volumes': self.volumes,
+            'sidecar_volumes': self.sidecar_volumes,
+        }
 
-    peers_count = len(kms_passwords)
-    if len(lbs_tokens) != peers_count:
-        print('The len of lbs_tokens is invalid')
-        sys.exit(1)
+    @property
+    def peers_count(self) -> int:
+        return len(self.kms_passwords)
+
+    @property
+    def is_chaincode_executor(self) -> bool:
+        return "chaincode" in find_docker_image(self.service_config, "executor")
+
+    @property
+    def node_port_span(self) -> int:
+        return gen_node_port_span(self.need_monitor_ports, self.need_debug, self.is_chaincode_executor)
+
+    @property
+    def need_monitor_ports(self) -> bool:
+        # prometheus finds the exporters of host mode by labels of pods
+        return self.need_monitor and self.monitor_mode == 'sidecar'
+
+    @property
+    def pod_scheduling(self) -> dict:
+        return gen_pod_scheduling(self.chain_name, self.anti_affinity, self.topology_spread, self.topology_key, self.priority_class)
+
+    @property
+    def pods_scheduling(self) -> Dict[str, dict]:
+        return {name: gen_pod_scheduling(self.chain_name, self.anti_affinity, self.topology_spread, self.topology_key, self.priority_class, name) for name in SERVICE_LIST}
+
+    def validate(self):
+        verify_service_config(self.service_config)
+        if len(self.lbs_tokens) != self.peers_count:
+            raise InvalidChainSpec('The len of lbs_tokens is invalid')
+        if not self.node_ports:
+            raise InvalidChainSpec('--node_ports is required unless ports are allocated')
+        if len(self.node_ports) != self.peers_count:
+            raise InvalidChainSpec('The len of node_ports is invalid')
+        from port_allocator import check_node_ports
+        check_node_ports(self)
+        if not self.statefulset and len(self.pvc_names) != self.peers_count:
+            raise InvalidChainSpec('The len of pvc_names is invalid')
+        if self.statefulset and any(volume['type'] == 'pvc' for _, volume in used_volumes(self.service_config)):
+            raise InvalidChainSpec('volumes of type pvc are shared by nodes, use storage_class with statefulset')
+        if self.monitor_mode not in MONITOR_MODES:
+            raise InvalidChainSpec('The monitor_mode is invalid, should be one of {}'.format(', '.join(MONITOR_MODES)))
+        if self.anti_affinity not in ANTI_AFFINITY_MODES:
+            raise InvalidChainSpec('The anti_affinity is invalid, should be one of {}'.format(', '.join(ANTI_AFFINITY_MODES)))
+        if self.session_affinity not in SESSION_AFFINITY_MODES:
+            raise InvalidChainSpec('The session_affinity is invalid, should be one of {}'.format(', '.join(SESSION_AFFINITY_MODES)))
+        if self.session_affinity == 'ClientIP' and not 0 < self.session_affinity_timeout <= 86400:
+            raise InvalidChainSpec('The session_affinity_timeout must be in 1-86400 seconds')
+        if self.layout not in LAYOUTS:
+            raise InvalidChainSpec('The layout is invalid, should be one of {}'.format(', '.join(LAYOUTS)))
+        if self.layout == 'split':
+            if self.statefulset:
+                raise InvalidChainSpec('pods of split layout share the datadir of the node, which volumeClaimTemplates of statefulset can not')
+            if self.need_monitor and self.monitor_mode == 'sidecar':
+                raise InvalidChainSpec('monitor-process watches the processes of all services in one pod, use --monitor_mode host with split layout')
+        elif any(gen_service_replicas(self.service_config, name) != 1 for name in SERVICE_LIST):
+            raise InvalidChainSpec('replicas of services need split layout')
+
+
+def gen_node_k8s_config(spec, i, container_templates, network_key=None):
+    if spec.statefulset:
+        # the other objects of the node are shared by the chain
+        selector = {STATEFULSET_POD_NAME_LABEL: get_node_pod_name(i, spec.chain_name)}
+        all_service = gen_all_service(i, spec.chain_name, spec.node_ports[i], spec.lbs_tokens[i], spec.need_monitor_ports, spec.need_debug, spec.is_chaincode_executor, selector)
+        return [all_service]
+
+    k8s_config = []
+    kms_secret = gen_kms_secret(spec.kms_passwords[i], gen_kms_secret_name_mc(spec.chain_name, i))
+    k8s_config.append(kms_secret)
+    netwok_secret = gen_network_secret(spec.chain_name, i, network_key)
+    k8s_config.append(netwok_secret)
+    k8s_config += gen_service_pvcs(spec.service_config, get_node_pod_name(i, spec.chain_name))
+    if spec.layout == 'split':
+        k8s_config += gen_split_node_objects(i, spec.service_config, spec.chain_name, spec.pvc_names[i], gen_kms_secret_name_mc(spec.chain_name, i), container_templates, spec.pods_scheduling)
+        k8s_config += gen_split_all_services(i, spec.chain_name, spec.node_ports[i], spec.lbs_tokens[i], spec.need_monitor_ports, spec.need_debug, spec.is_chaincode_executor)
+        return k8s_config
+    deployment = gen_node_deployment(i, spec.service_config, spec.chain_name, spec.pvc_names[i], spec.state_db_user, spec.state_db_password, spec.need_monitor, gen_kms_secret_name_mc(spec.chain_name, i), spec.need_debug, spec.docker_registry, spec.docker_image_namespace, container_templates, spec.pod_scheduling)
+    k8s_config.append(deployment)
+    all_service = gen_all_service(i, spec.chain_name, spec.node_ports[i], spec.lbs_tokens[i], spec.need_monitor_ports, spec.need_debug, spec.is_chaincode_executor)
+    k8s_config.append(all_service)
+    return k8s_config
+
+
+# objects shared by all nodes of the chain
+def gen_chain_k8s_config(spec, container_templates):
+    k8s_config = []
+    if spec.priority_class:
+        priority_class = gen_priority_class(spec.priority_class, spec.priority_value)
+        k8s_config.append(priority_class)
+    if spec.pdb and spec.layout == 'split':
+        for name in SERVICE_LIST:
+            k8s_config.append(gen_pod_disruption_budget(spec.chain_name, spec.peers_count, name, gen_service_replicas(spec.service_config, name)))
+    elif spec.pdb:
+        pod_disruption_budget = gen_pod_disruption_budget(spec.chain_name, spec.peers_count)
+        k8s_config.append(pod_disruption_budget)
+    if spec.rpc_gateway:
+        selector = None
+        if spec.layout == 'split':
+            selector = dict(gen_chain_pod_selector(spec.chain_name, 'controller')['matchLabels'])
+        rpc_gateway = gen_grpc_service(spec.chain_name, spec.rpc_gateway_port, spec.session_affinity, spec.session_affinity_timeout, selector)
+        k8s_config.append(rpc_gateway)
+    if spec.need_monitor and spec.monitor_mode == 'host':
+        k8s_config.append(gen_scrape_config_map(spec.chain_name))
+    if spec.prepull:
+        prepull_daemonset = gen_prepull_daemonset(spec.chain_name, container_templates, spec.docker_registry, spec.docker_image_namespace, spec.image_digests)
+        k8s_config.append(prepull_daemonset)
+    if not spec.statefulset:
+        return k8s_config
+    kms_secret = gen_chain_kms_secret(spec.kms_passwords, gen_kms_secret_name(spec.chain_name))
+    k8s_config.append(kms_secret)
+    netwok_secret = gen_chain_network_secret(spec.chain_name, spec.peers_count)
+    k8s_config.append(netwok_secret)
+    headless_service = gen_headless_service(spec.chain_name)
+    k8s_config.append(headless_service)
+    statefulset = gen_statefulset(spec.chain_name, spec.peers_count, spec.service_config, container_templates, spec.storage_class, spec.storage_size, spec.docker_registry, spec.docker_image_namespace, spec.pod_scheduling, spec.image_digests)
+    k8s_config.append(statefulset)
+    return k8s_config
+
+
+def compile_chain_templates(spec):
+    return compile_container_templates(spec.service_config, spec.state_db_user, spec.state_db_password, spec.need_monitor, spec.need_debug, spec.docker_registry, spec.docker_image_namespace, spec.image_digests, spec.monitor_mode, spec.layout, spec.rpc_gateway)
+
+
+def generate_chain(spec: ChainSpec, nodes: Optional[Iterable[int]] = None) -> Iterator[Tuple[Optional[int], List[dict]]]:
+    """Lazily yield (node_index, k8s objects) of the nodes of a chain.
+
+    All nodes are generated if nodes is None, and the objects shared by all nodes,
+    if there are any, are yielded first with node_index None.
+    Raises InvalidChainSpec before yielding anything if spec is invalid.
+    """
+    spec.validate()
+    # containers are same for all nodes except subPath
+    container_templates = compile_chain_templates(spec)
+    if nodes is None:
+        chain_config = gen_chain_k8s_config(spec, container_templates)
+        if chain_config:
+            yield None, chain_config
+        nodes = range(spec.peers_count)
+    for i in nodes:
+        yield i, gen_node_k8s_config(spec, i, container_templates)
+
+
+def dump_k8s_config(k8s_config: List[dict]) -> str:
+    import yaml
+    return yaml.dump_all(k8s_config, sort_keys=False)
+
+
+# bump it when the generated config of same inputs changes
+CACHE_VERSION = 2
+
+# fields of spec which are replaced by the value of the node
+CACHE_IGNORED_FIELDS = [
+    'kms_passwords',
+    'lbs_tokens',
+    'node_ports',
+    'pvc_names',
+]
+
+
+# key of the objects shared by all nodes in cache, beside the node indexes
+CHAIN_CACHE_KEY = 'chain'
+
+
+def gen_cache_path(work_dir, chain_name):
+    return os.path.join(work_dir, '.{}-cache.json'.format(chain_name))
+
+
+def load_cache(cache_path):
+    try:
+        with open(cache_path, 'rt') as stream:
+            cache = json.load(stream)
+    except (OSError, ValueError):
+        return {}
+    if cache.get('version') != CACHE_VERSION:
+        return {}
+    return cache['nodes']
+
+
+def dump_cache(nodes_hash):
+    return json.dumps({'version': CACHE_VERSION, 'nodes': nodes_hash}, indent=2, sort_keys=True)
 
-    if len(node_ports) != peers_count:
-        print('The len of node_ports is invalid')
-        sys.exit(1)
-    
-    if len(pvc_names) != peers_count:
-        print('The len of pvc_names is invalid')
-        sys.exit(1)
 
-    # is chaincode executor
-    executor_docker_image = find_docker_image(service_config, "executor")
-    is_chaincode_executor = "chaincode" in executor_docker_image
+# digest of the fields shared by all nodes, computed once per chain instead of once per node,
+# the per node lists are left out without copying them
+def gen_spec_inputs_hash(spec):
+    fields = {field.name: getattr(spec, field.name) for field in dataclasses.fields(spec) if field.name not in CACHE_IGNORED_FIELDS}
+    data = json.dumps(fields, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def gen_node_inputs_hash(spec, i, spec_hash=None):
+    if spec_hash is None:
+        spec_hash = gen_spec_inputs_hash(spec)
+    inputs = {
+        'version': CACHE_VERSION,
+        'index': i,
+        'spec': spec_hash,
+        'kms_password': spec.kms_passwords[i],
+        'lbs_token': spec.lbs_tokens[i],
+        'node_port': spec.node_ports[i],
+        'pvc_name': spec.pvc_names[i] if spec.pvc_names else None,
+    }
+    data = json.dumps(inputs, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+# objects shared by all nodes depend on the values of every node
+def gen_chain_inputs_hash(spec):
+    inputs = {
+        'version': CACHE_VERSION,
+        'spec': dataclasses.asdict(spec),
+    }
+    data = json.dumps(inputs, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def gen_chain_yaml_path(work_dir, chain_name):
+    return os.path.join(work_dir, '{}.yaml'.format(chain_name))
+
+
+def gen_node_yaml_path(work_dir, chain_name, i):
+    return os.path.join(work_dir, '{}-{}.yaml'.format(chain_name, i))
+
+
+def load_schema_validator(validate):
+    if not validate:
+        return None
+    import k8s_schema
+    return k8s_schema.load_validator()
+
+
+# network key of the node in a file written before, so that regenerating a node keeps its identity
+def load_network_key(path, network_secret_name):
+    if not os.path.exists(path):
+        return None
+    import yaml
+    with open(path, 'rt') as stream:
+        documents = stream.read().split('\n---\n')
+    for document in documents:
+        # only the small document of the secret is parsed
+        if 'kind: Secret' not in document or network_secret_name not in document:
+            continue
+        obj = yaml.safe_load(document)
+        if obj and obj.get('kind') == 'Secret' and obj['metadata']['name'] == network_secret_name:
+            return (obj.get('data') or {}).get('network-key')
+    return None
+
+
+def gen_node_yaml(spec, i, container_templates, validator=None, timer=None, network_key=None):
+    if timer is None:
+        from phase_timer import PhaseTimer
+        timer = PhaseTimer()
+    with timer.phase('build'):
+        k8s_config = gen_node_k8s_config(spec, i, container_templates, network_key)
+    if validator is not None:
+        with timer.phase('validate'):
+            validator.check(k8s_config)
+    with timer.phase('serialize'):
+        return dump_k8s_config(k8s_config)
+
+
+# spec and templates are sent to each worker process once instead of with every node,
+# each worker loads the validator from the disk cache
+_worker_context = {}
+
+
+def _init_worker(spec, container_templates, validate):
+    _worker_context['spec'] = spec
+    _worker_context['container_templates'] = container_templates
+    _worker_context['validator'] = load_schema_validator(validate)
+
+
+# phases of the node are sent back with its yaml
+def _gen_node_yaml_in_worker(i, network_key):
+    from phase_timer import PhaseTimer
+    timer = PhaseTimer()
+    node_yaml = gen_node_yaml(_worker_context['spec'], i, _worker_context['container_templates'], _worker_context['validator'], timer, network_key)
+    return node_yaml, timer.phases
+
+
+# yield (index, yaml, error) of each node in order of index
+# errors are reported per node, so one bad node does not abort the others
+# network_keys is {index: network key to keep} of the nodes
+def gen_nodes_yaml(spec, nodes, container_templates, jobs, validate=False, timer=None, network_keys=None):
+    network_keys = network_keys or {}
+    if timer is None:
+        from phase_timer import PhaseTimer
+        timer = PhaseTimer()
+    if jobs <= 1:
+        with timer.phase('validate'):
+            validator = load_schema_validator(validate)
+        for i in nodes:
+            try:
+                yield i, gen_node_yaml(spec, i, container_templates, validator, timer, network_keys.get(i)), None
+            except Exception as e:
+                yield i, None, e
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(spec, container_templates, validate)) as executor:
+        futures = [executor.submit(_gen_node_yaml_in_worker, i, network_keys.get(i)) for i in nodes]
+        for i, future in zip(nodes, futures):
+            try:
+                node_yaml, phases = future.result()
+            except Exception as e:
+                yield i, None, e
+                continue
+            timer.merge(phases)
+            yield i, node_yaml, None
+
+
+# write documents of all nodes to one stream, flush after each node
+# so that consumer like `kubectl apply -f -` can start early
+class StreamWriter:
+    # all nodes are written every time, nothing to skip
+    use_cache = False
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.is_first = True
+
+    def write(self, path, content):
+        if not self.is_first:
+            self.stream.write('---\n')
+        self.is_first = False
+        self.stream.write(content)
+        self.stream.flush()
+
+    def commit(self):
+        pass
+
+    def discard(self):
+        pass
+
+
+# umask can only be read by setting it, read it once before any worker thread starts
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def gen_file_mode(path):
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+# write to temp files first, then fsync and rename all of them in commit
+# so that an interrupted run never leaves half-written files
+class AtomicFileWriter:
+    use_cache = True
+
+    def __init__(self):
+        self.pending = []
+
+    def write(self, path, content):
+        import tempfile
+        dir_name, file_name = os.path.split(path)
+        fd, tmp_path = tempfile.mkstemp(prefix='.{}.'.format(file_name), suffix='.tmp', dir=dir_name)
+        self.pending.append((tmp_path, path))
+        # mkstemp creates the file as 0600, keep the mode of the file it replaces, or the umask for a new one
+        os.chmod(tmp_path, gen_file_mode(path))
+        with os.fdopen(fd, 'wt') as stream:
+            stream.write(content)
+
+    def commit(self):
+        for tmp_path, _ in self.pending:
+            fd = os.open(tmp_path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        dir_names = set()
+        for tmp_path, path in self.pending:
+            os.replace(tmp_path, path)
+            dir_names.add(os.path.dirname(path))
+        for dir_name in dir_names:
+            fd = os.open(dir_name, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        self.pending = []
+
+    def discard(self):
+        for tmp_path, _ in self.pending:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.pending = []
+
+
+# regenerated: count of nodes written
+# skipped: count of nodes whose inputs are unchanged
+# failed_nodes: indexes of nodes failed to generate
+WriteChainResult = collections.namedtuple('WriteChainResult', ['regenerated', 'skipped', 'failed_nodes'])
+
+
+# timer gets the time of phases: validate, compile, cache, build, serialize and write
+def write_chain(spec, work_dir, writer, jobs=1, incremental=True, validate=False, timer=None):
+    if timer is None:
+        from phase_timer import PhaseTimer
+        timer = PhaseTimer()
+    with timer.phase('validate'):
+        spec.validate()
+
+    # containers are same for all nodes except subPath
+    with timer.phase('compile'):
+        container_templates = compile_chain_templates(spec)
+
+    # skip the nodes whose inputs are unchanged
+    cache_path = gen_cache_path(work_dir, spec.chain_name)
+    with timer.phase('cache'):
+        cached_hash = load_cache(cache_path) if incremental and writer.use_cache else {}
+    nodes_hash = {}
+    new_nodes_hash = {}
+
+    # objects shared by all nodes, regenerated when any input changes
+    with timer.phase('build'):
+        chain_config = gen_chain_k8s_config(spec, container_templates)
+    chain_yaml_path = gen_chain_yaml_path(work_dir, spec.chain_name)
+    nodes = []
+    skipped_count = 0
+    with timer.phase('cache'):
+        chain_hash = gen_chain_inputs_hash(spec) if chain_config else None
+        if chain_config and cached_hash.get(CHAIN_CACHE_KEY) == chain_hash and os.path.exists(chain_yaml_path):
+            nodes_hash[CHAIN_CACHE_KEY] = chain_hash
+            chain_config = []
+        spec_hash = gen_spec_inputs_hash(spec)
+        for i in range(spec.peers_count):
+            node_hash = gen_node_inputs_hash(spec, i, spec_hash)
+            if cached_hash.get(str(i)) == node_hash and os.path.exists(gen_node_yaml_path(work_dir, spec.chain_name, i)):
+                nodes_hash[str(i)] = node_hash
+                skipped_count += 1
+                continue
+            new_nodes_hash[i] = node_hash
+            nodes.append(i)
 
     # generate k8s yaml
-    for i in range(peers_count):
-        k8s_config = []
-        kms_secret = gen_kms_secret(kms_passwords[i], gen_kms_secret_name_mc(args.chain_name, i))
-        k8s_config.append(kms_secret)
-        netwok_secret = gen_network_secret(args.chain_name, i)
-        k8s_config.append(netwok_secret)
-        deployment = gen_node_deployment(i, service_config, args.chain_name, pvc_names[i], args.state_db_user, args.state_db_password, args.need_monitor, gen_kms_secret_name_mc(args.chain_name, i), args.need_debug, args.docker_registry, args.docker_image_namespace)
-        k8s_config.append(deployment)
-        all_service = gen_all_service(i, args.chain_name, node_ports[i], lbs_tokens[i], args.need_monitor, args.need_debug, is_chaincode_executor)
-        k8s_config.append(all_service)
-        # write k8s_config to yaml file
-        yaml_ptah = os.path.join(work_dir, '{}-{}.yaml'.format(args.chain_name, i))
-        print("yaml_ptah:{}", yaml_ptah)
-        with open(yaml_ptah, 'wt') as stream:
-            yaml.dump_all(k8s_config, stream, sort_keys=False)
+    failed_nodes = []
+    regenerated_count = 0
+    try:
+        if chain_config:
+            with timer.phase('validate'):
+                errors = load_schema_validator(validate).collect_errors(chain_config) if validate else []
+            if errors:
+                print('generate chain objects failed: {}'.format('\n'.join(errors)))
+                failed_nodes.append(CHAIN_CACHE_KEY)
+            else:
+                if writer.use_cache:
+                    import manifest_diff
+                    keep_network_key(chain_config, manifest_diff.load_manifests(chain_yaml_path), gen_chain_network_secret_name(spec.chain_name))
+                    print("yaml_ptah:{}", chain_yaml_path)
+                with timer.phase('serialize'):
+                    chain_yaml = dump_k8s_config(chain_config)
+                with timer.phase('write'):
+                    writer.write(chain_yaml_path, chain_yaml)
+                nodes_hash[CHAIN_CACHE_KEY] = chain_hash
+        with timer.phase('write'):
+            write_process_exporter(spec, work_dir, writer)
+
+        # nodes regenerated in place keep their network keys, like write_chain_patches does
+        network_keys = {}
+        if writer.use_cache and not spec.statefulset:
+            with timer.phase('cache'):
+                for i in nodes:
+                    network_keys[i] = load_network_key(gen_node_yaml_path(work_dir, spec.chain_name, i), gen_network_secret_name(spec.chain_name, i))
+
+        for i, node_yaml, err in gen_nodes_yaml(spec, nodes, container_templates, jobs, validate, timer, network_keys):
+            if err is not None:
+                print('generate node {} failed: {}'.format(i, err))
+                failed_nodes.append(i)
+                continue
+            # write k8s_config to yaml file
+            yaml_ptah = gen_node_yaml_path(work_dir, spec.chain_name, i)
+            if writer.use_cache:
+                print("yaml_ptah:{}", yaml_ptah)
+            with timer.phase('write'):
+                writer.write(yaml_ptah, node_yaml)
+            nodes_hash[str(i)] = new_nodes_hash[i]
+            regenerated_count += 1
+
+        with timer.phase('write'):
+            if writer.use_cache:
+                writer.write(cache_path, dump_cache(nodes_hash))
+            writer.commit()
+    except BaseException:
+        writer.discard()
+        raise
+    return WriteChainResult(regenerated_count, skipped_count, failed_nodes)
+
+
+def gen_patches_path(work_dir, chain_name):
+    return os.path.join(work_dir, '{}-patches.yaml'.format(chain_name))
+
+
+def gen_rollout_report_path(work_dir, chain_name):
+    return os.path.join(work_dir, '{}-rollout-report.json'.format(chain_name))
+
+
+# network key is random, keep the previous one so that it is not seen as a change
+def keep_network_key(k8s_config, old_objects, network_secret_name):
+    old_secrets = [obj for obj in old_objects if obj['kind'] == 'Secret' and obj['metadata']['name'] == network_secret_name]
+    if not old_secrets:
+        return
+    old_data = old_secrets[0].get('data') or {}
+    for obj in k8s_config:
+        if obj['kind'] == 'Secret' and obj['metadata']['name'] == network_secret_name:
+            # keys of the nodes which still exist
+            obj['data'] = {key: old_data.get(key, value) for key, value in obj['data'].items()}
+
+
+# write config files of all nodes, and the changes against previous_dir:
+# {chain_name}-patches.yaml with one document for each changed object,
+# {chain_name}-rollout-report.json with the nodes whose pods will restart
+def write_chain_patches(spec, work_dir, previous_dir, patch_type, validate=False):
+    import manifest_diff
+
+    spec.validate()
+    validator = load_schema_validator(validate)
+    validation_errors = []
+    writer = AtomicFileWriter()
+    patches = []
+    report = {'patchType': patch_type, 'nodes': []}
+    nodes_hash = {}
+    spec_hash = gen_spec_inputs_hash(spec)
+
+    def add_node_changes(i, old_objects, new_objects):
+        changes, rolls = manifest_diff.diff_manifests(old_objects, new_objects, patch_type)
+        for change in changes:
+            patches.append(dict(node=i, **change))
+        report['nodes'].append({
+            'node': i,
+            'changed': ['{}/{}'.format(change['kind'], change['name']) for change in changes],
+            'rolls': rolls,
+        })
+
+    try:
+        for i, k8s_config in generate_chain(spec):
+            if i is None:
+                # objects shared by all nodes
+                i = CHAIN_CACHE_KEY
+                old_path = gen_chain_yaml_path(previous_dir, spec.chain_name)
+                new_path = gen_chain_yaml_path(work_dir, spec.chain_name)
+                network_secret_name = gen_chain_network_secret_name(spec.chain_name)
+                node_hash = gen_chain_inputs_hash(spec)
+            else:
+                old_path = gen_node_yaml_path(previous_dir, spec.chain_name, i)
+                new_path = gen_node_yaml_path(work_dir, spec.chain_name, i)
+                network_secret_name = gen_network_secret_name(spec.chain_name, i)
+                node_hash = gen_node_inputs_hash(spec, i, spec_hash)
+            if validator is not None:
+                validation_errors += ['node {} {}'.format(i, error) for error in validator.collect_errors(k8s_config)]
+            old_objects = manifest_diff.load_manifests(old_path)
+            keep_network_key(k8s_config, old_objects, network_secret_name)
+            add_node_changes(i, old_objects, k8s_config)
+            writer.write(new_path, dump_k8s_config(k8s_config))
+            nodes_hash[str(i)] = node_hash
+
+        # objects shared by all nodes are gone, when the chain leaves statefulset mode
+        if CHAIN_CACHE_KEY not in nodes_hash:
+            old_objects = manifest_diff.load_manifests(gen_chain_yaml_path(previous_dir, spec.chain_name))
+            if old_objects:
+                add_node_changes(CHAIN_CACHE_KEY, old_objects, [])
+
+        # nodes removed from the chain
+        i = spec.peers_count
+        while os.path.exists(gen_node_yaml_path(previous_dir, spec.chain_name, i)):
+            old_objects = manifest_diff.load_manifests(gen_node_yaml_path(previous_dir, spec.chain_name, i))
+            add_node_changes(i, old_objects, [])
+            i += 1
+
+        # report errors of all nodes at once
+        if validation_errors:
+            from k8s_schema import SchemaValidationError
+            raise SchemaValidationError(validation_errors)
+
+        report['rolling_nodes'] = [node['node'] for node in report['nodes'] if node['rolls']]
+        write_process_exporter(spec, work_dir, writer)
+        writer.write(gen_patches_path(work_dir, spec.chain_name), dump_k8s_config(patches))
+        writer.write(gen_rollout_report_path(work_dir, spec.chain_name), json.dumps(report, indent=2))
+        writer.write(gen_cache_path(work_dir, spec.chain_name), dump_cache(nodes_hash))
+        writer.commit()
+    except BaseException:
+        writer.discard()
+        raise
+    return report
+
+
+def run_operator(args, work_dir, stream=None):
+    from phase_timer import PhaseTimer
+    timer = PhaseTimer()
+    success = False
+    try:
+        if args.profile:
+            from phase_timer import run_profiled
+            run_profiled(work_dir, args.chain_name, run_operator_timed, args, work_dir, stream, timer)
+        else:
+            run_operator_timed(args, work_dir, stream, timer)
+        success = True
+    finally:
+        if args.profile or args.metrics_file:
+            print(timer.report())
+        if args.metrics_file:
+            from phase_timer import write_metrics
+            write_metrics(args.metrics_file, timer, 'cita_cloud_operator', {'chain': args.chain_name}, success)
+            print('metrics:', os.path.abspath(args.metrics_file))
+
+
+def run_operator_timed(args, work_dir, stream, timer):
+    if args.stream:
+        writer = StreamWriter(stream or sys.stdout)
+    else:
+        writer = AtomicFileWriter()
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+
+    try:
+        with timer.phase('load_config'):
+            spec = ChainSpec.from_args(args)
+        print("service_config:", spec.service_config)
+        if not spec.node_ports or args.port_allocations:
+            from port_allocator import assign_node_ports, gen_port_allocations_path, parse_port_range
+            port_allocations = args.port_allocations or gen_port_allocations_path(work_dir)
+            with timer.phase('allocate_ports'):
+                assign_node_ports(spec, port_allocations, parse_port_range(args.port_range))
+            print('node_ports:', spec.node_ports)
+            print('port allocations:', port_allocations)
+        timer.set('nodes', spec.peers_count)
+        if args.previous_dir:
+            with timer.phase('patches'):
+                report = write_chain_patches(spec, work_dir, os.path.abspath(args.previous_dir), args.patch_type, args.validate)
+            print('Changed objects: {}, rolling nodes: {}'.format(sum(len(node['changed']) for node in report['nodes']), report['rolling_nodes']))
+            print('patches:', gen_patches_path(work_dir, spec.chain_name))
+            print('rollout report:', gen_rollout_report_path(work_dir, spec.chain_name))
+            print("Done!!!")
+            return
+        result = write_chain(spec, work_dir, writer, jobs, args.incremental, args.validate, timer)
+    except OperatorError as e:
+        print(e)
+        sys.exit(1)
+    print('Regenerated nodes: {}, skipped nodes: {}'.format(result.regenerated, result.skipped))
+    timer.set('regenerated_nodes', result.regenerated)
+    timer.set('skipped_nodes', result.skipped)
+    timer.set('failed_nodes', len(result.failed_nodes))
+
+    if result.failed_nodes:
+        print('Failed nodes:', result.failed_nodes)
+        sys.exit(1)
 
     print("Done!!!")
 
 
 def main():
     args = parse_arguments()
-    print("args:", args)
     work_dir = os.path.abspath(args.work_dir)
-    run_operator(args, work_dir)
+    if args.watch_dir:
+        from reconcile_daemon import run_daemon
+        print("args:", args)
+        run_daemon(args, work_dir)
+    elif args.stream:
+        # stdout is used by documents, print messages to stderr
+        stream = sys.stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            print("args:", args)
+            run_operator(args, work_dir, stream)
+    else:
+        print("args:", args)
+        run_operator(args, work_dir)
 
 
 if __name__ == '__main__':
+    # modules imported lazily import this script as cita_cloud_operator,
+    # share this module with them instead of loading it again
+    sys.modules.setdefault('cita_cloud_operator', sys.modules[__name__])
     main()
@@ -2,28 +2,44 @@
 # -*- coding:utf-8 -*-
 # pylint: disable=missing-docstring
 
+import argparse
+import json
 import os
-import subprocess
+import re
 import shutil
+import sys
 
-def main():
-    cmd = './kms create -k key_file'
-    kms_create = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    output = kms_create.stdout.readlines()[-1].decode().strip()
-    print("kms create output:", output)
-    # output should looks like: key_id:1,address:0xba21324990a2feb0a0b6ca16b444b5585b841df9
-    infos = output.split(',')
-    key_id = infos[0].split(':')[1]
-    address = infos[1].split(':')[1]
-
-    current_dir = os.path.abspath(os.curdir)
-    dir = os.path.join(current_dir, address)
-    if not os.path.exists(dir):
-        os.makedirs(dir)
-    
-    shutil.move(os.path.join(current_dir, 'kms.db'), os.path.join(dir, 'kms.db'))
-    shutil.move(os.path.join(current_dir, 'key_file'), os.path.join(dir, 'key_file'))
+MANIFEST_FILE_NAME = 'accounts.json'
+
+# output of kms create looks like: key_id:1,address:0xba21324990a2feb0a0b6ca16b444b5585b841df9
+KMS_OUTPUT_PATTERN = re.compile(r'key_id:([^,\s]+),address:(0x[0-9a-fA-F]+)')
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--count',
+        type=int,
+        help='Create this many accounts concurrently, each in its own temp dir, and write {}.'.format(MANIFEST_FILE_NAME))
+
+    parser.add_argument(
+        '--concurrency', type=int, default=4, help='Max number of kms processes running at the same time.')
+
+    parser.add_argument(
+        '--kms', default='./kms', help='Path of kms binary.')
+
+    parser.add_argument(
+        '--key_file', default='key_file', help='Password file of kms, copied into the dir of each account if exists.')
+
+    parser.add_argument(
+        '--work_dir', default='.', help='The output director of accounts.')
 
+    args = parser.parse_args()
+    return args
+
+
+def write_account_files(dir, key_id, address):
     path = os.path.join(dir, 'key_id')
     with open(path, 'wt') as stream:
         stream.write(key_id)
@@ -33,5 +49,129 @@ def main():
         stream.write(address)
 
 
+# run kms create in tmp_dir, parse key_id and address from its output as it streams out
+async def run_kms_create(kms, tmp_dir):
+    import asyncio
+
+    proc = await asyncio.create_subprocess_exec(
+        kms, 'create', '-k', 'key_file',
+        cwd=tmp_dir, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    key_id = address = None
+    last_line = ''
+    async for line in proc.stdout:
+        line = line.decode(errors='replace').strip()
+        if line:
+            last_line = line
+        match = KMS_OUTPUT_PATTERN.search(line)
+        if match:
+            key_id, address = match.group(1), match.group(2)
+    returncode = await proc.wait()
+    if returncode != 0:
+        raise RuntimeError('kms create exited with {}: {}'.format(returncode, last_line))
+    if address is None:
+        raise RuntimeError('unexpected kms create output: {}'.format(last_line))
+    return key_id, address
+
+
+async def create_account(index, args, work_dir, semaphore):
+    import tempfile
+
+    async with semaphore:
+        tmp_dir = tempfile.mkdtemp(prefix='.account-{}-'.format(index), dir=work_dir)
+        try:
+            if os.path.exists(args.key_file):
+                shutil.copy(args.key_file, os.path.join(tmp_dir, 'key_file'))
+            key_id, address = await run_kms_create(os.path.abspath(args.kms), tmp_dir)
+            write_account_files(tmp_dir, key_id, address)
+            dir = os.path.join(work_dir, address)
+            if os.path.exists(dir):
+                raise RuntimeError('account dir {} already exists'.format(dir))
+            os.rename(tmp_dir, dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+    print('account {} address: {}'.format(index, address))
+    return {'index': index, 'key_id': key_id, 'address': address}
+
+
+async def create_accounts(args, work_dir, indexes):
+    import asyncio
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    tasks = [create_account(i, args, work_dir, semaphore) for i in indexes]
+    return await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rt') as stream:
+        return json.load(stream)
+
+
+# write to a temp file and rename it, so an interrupted run never truncates the manifest
+def save_manifest(path, accounts):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wt') as stream:
+        json.dump(accounts, stream, indent=2)
+    os.replace(tmp_path, path)
+
+
+def run_batch(args):
+    import asyncio
+
+    work_dir = os.path.abspath(args.work_dir)
+    if not os.path.exists(work_dir):
+        os.makedirs(work_dir)
+    path = os.path.join(work_dir, MANIFEST_FILE_NAME)
+    try:
+        accounts = load_manifest(path)
+    except (OSError, ValueError) as e:
+        print('load manifest {} failed: {}'.format(path, e))
+        sys.exit(1)
+
+    # accounts of a rerun are added after the accounts of the previous runs
+    start = max((account['index'] for account in accounts), default=-1) + 1
+    indexes = range(start, start + args.count)
+    results = asyncio.run(create_accounts(args, work_dir, indexes))
+
+    failed = False
+    for i, result in zip(indexes, results):
+        if isinstance(result, Exception):
+            print('create account {} failed: {}'.format(i, result))
+            failed = True
+        else:
+            accounts.append(result)
+
+    save_manifest(path, accounts)
+    print('manifest:', path)
+    if failed:
+        sys.exit(1)
+
+
+# one account in work_dir, created the same way as each account of a batch but without the manifest
+def run_single(args):
+    import asyncio
+
+    work_dir = os.path.abspath(args.work_dir)
+    if not os.path.exists(work_dir):
+        os.makedirs(work_dir)
+    result, = asyncio.run(create_accounts(args, work_dir, [0]))
+    if isinstance(result, Exception):
+        print('create account failed: {}'.format(result))
+        sys.exit(1)
+
+
+def main():
+    args = parse_arguments()
+    if args.count is not None:
+        if args.count <= 0 or args.concurrency <= 0:
+            print('count and concurrency must be positive')
+            sys.exit(1)
+        run_batch(args)
+        return
+    run_single(args)
+
+
 if __name__ == '__main__':
     main()
@@ -4,10 +4,32 @@
 
 import argparse
 import os
-import yaml
+import sys
+
+
+def str_to_bool(value):
+    if isinstance(value, bool):
+        return value
+    if value.lower() == 'false':
+        return False
+    elif value.lower() == 'true':
+        return True
+    raise ValueError(f'{value} is not a valid boolean value')
+
 
 def parse_arguments():
     parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--profile',
+        type=str_to_bool,
+        default=False,
+        help='Run under cProfile and tracemalloc, write the reports to the current dir and print the time of each phase')
+
+    parser.add_argument(
+        '--metrics_file',
+        help='Write the time of each phase to this file in Prometheus text format.')
+
     subparsers = parser.add_subparsers(
         dest='subcmd', title='subcommands', help='additional help')
 
@@ -24,6 +46,40 @@ def parse_arguments():
     plocal_pvc.add_argument(
             '--node_list', default='minikube', help='Host name list of nodes of k8s cluster.')
 
+    #
+    # Subcommand: node_pvc
+    #
+
+    pnode_pvc = subparsers.add_parser(
+        SUBCMD_NODE_PVC, help='Create one local pv/pvc for each node of a chain.')
+
+    pnode_pvc.add_argument(
+        '--chain_name', default='test-chain', help='The name of chain.')
+
+    pnode_pvc.add_argument(
+        '--peers_count', type=int, default=4, help='The number of nodes of the chain.')
+
+    pnode_pvc.add_argument(
+        '--node_list', default='minikube', help='Host name list of nodes of k8s cluster.')
+
+    pnode_pvc.add_argument(
+        '--device_paths', default='/mnt/nvme0', help='Mount point list of local disks, same on each host.')
+
+    pnode_pvc.add_argument(
+        '--capacity', default='100Gi', help='Capacity of each pv.')
+
+    pnode_pvc.add_argument(
+        '--request', help='Storage request of each pvc, same as --capacity if not set.')
+
+    pnode_pvc.add_argument(
+        '--storage_class', default='local-storage', help='StorageClass of pv/pvc.')
+
+    pnode_pvc.add_argument(
+        '--statefulset',
+        type=str_to_bool,
+        default=False,
+        help='Name pvc as the volumeClaimTemplates of cita_cloud_operator.py --statefulset true')
+
     #
     # Subcommand: nfs_pvc
     #
@@ -54,19 +110,22 @@ def parse_arguments():
     return args
 
 
-def run_subcmd_local_pvc(args, work_dir):
+def write_k8s_config(yaml_ptah, k8s_config, timer):
+    # load yaml only when writing, so -h stays fast
+    import yaml
+    print("yaml_ptah:{}", yaml_ptah)
+    with timer.phase('serialize'):
+        content = yaml.dump_all(k8s_config, sort_keys=False)
+    with timer.phase('write'):
+        with open(yaml_ptah, 'wt') as stream:
+            stream.write(content)
+
+
+def run_subcmd_local_pvc(args, work_dir, timer):
     node_list = args.node_list.split(',')
 
     k8s_config = []
-    storage_class = {
-        'kind': 'StorageClass',
-        'apiVersion': 'storage.k8s.io/v1',
-        'metadata': {
-            'name': 'local-storage',
-        },
-        'provisioner': 'kubernetes.io/no-provisioner',
-        'volumeBindingMode': 'WaitForFirstConsumer',
-    }
+    storage_class = gen_local_storage_class('local-storage')
     k8s_config.append(storage_class)
     local_pv = {
         'apiVersion': 'v1',
@@ -126,14 +185,137 @@ def run_subcmd_local_pvc(args, work_dir):
 
     # write k8s_config to yaml file
     yaml_ptah = os.path.join(work_dir, 'local-pvc.yaml')
-    print("yaml_ptah:{}", yaml_ptah)
-    with open(yaml_ptah, 'wt') as stream:
-        yaml.dump_all(k8s_config, stream, sort_keys=False)
+    write_k8s_config(yaml_ptah, k8s_config, timer)
 
     print("Done!!!")
 
 
-def run_subcmd_nfs_pvc(args, work_dir):
+# spread nodes over hosts round robin, then over the disks of each host
+def place_nodes(peers_count, node_list, device_paths):
+    placements = []
+    for i in range(peers_count):
+        host = node_list[i % len(node_list)]
+        device_path = device_paths[i // len(node_list) % len(device_paths)]
+        placements.append((host, device_path))
+    return placements
+
+
+def gen_local_storage_class(storage_class):
+    local_storage_class = {
+        'kind': 'StorageClass',
+        'apiVersion': 'storage.k8s.io/v1',
+        'metadata': {
+            'name': storage_class,
+        },
+        'provisioner': 'kubernetes.io/no-provisioner',
+        'volumeBindingMode': 'WaitForFirstConsumer',
+    }
+    return local_storage_class
+
+
+# pv of one node, pinned to the host by nodeAffinity
+def gen_node_pv(pv_name, host, path, capacity, storage_class):
+    node_pv = {
+        'apiVersion': 'v1',
+        'kind': 'PersistentVolume',
+        'metadata': {
+            'name': pv_name,
+        },
+        'spec': {
+            'capacity': {
+                'storage': capacity,
+            },
+            'volumeMode': 'Filesystem',
+            'accessModes': [
+                'ReadWriteOnce',
+            ],
+            'persistentVolumeReclaimPolicy': 'Retain',
+            'storageClassName': storage_class,
+            'local': {
+                'path': path,
+            },
+            'nodeAffinity': {
+                'required': {
+                    'nodeSelectorTerms': [
+                        {
+                            'matchExpressions': [
+                                {
+                                    'key': 'kubernetes.io/hostname',
+                                    'operator': 'In',
+                                    'values': [host]
+                                },
+                            ],
+                        },
+                    ],
+                },
+            },
+        },
+    }
+    return node_pv
+
+
+# pvc bound to the pv of the node by volumeName
+def gen_node_pvc(pvc_name, pv_name, request, storage_class):
+    node_pvc = {
+        'kind': 'PersistentVolumeClaim',
+        'apiVersion': 'v1',
+        'metadata': {
+            'name': pvc_name,
+        },
+        'spec': {
+            'accessModes': [
+                'ReadWriteOnce',
+            ],
+            'resources': {
+                'requests': {
+                    'storage': request,
+                },
+            },
+            'storageClassName': storage_class,
+            'volumeName': pv_name,
+        },
+    }
+    return node_pvc
+
+
+def run_subcmd_node_pvc(args, work_dir, timer):
+    # names of the pods and pvcs must match those of the operator, load it only for this subcommand
+    from cita_cloud_operator import get_node_pod_name, gen_node_pvc_name, gen_statefulset_pvc_name
+
+    node_list = [host for host in args.node_list.split(',') if host]
+    device_paths = [path for path in args.device_paths.split(',') if path]
+    if args.peers_count <= 0 or not node_list or not device_paths:
+        print('peers_count, node_list and device_paths must not be empty')
+        sys.exit(1)
+
+    k8s_config = [gen_local_storage_class(args.storage_class)]
+    pvc_names = []
+    timer.set('nodes', args.peers_count)
+    with timer.phase('build'):
+        for i, (host, device_path) in enumerate(place_nodes(args.peers_count, node_list, device_paths)):
+            node_name = get_node_pod_name(i, args.chain_name)
+            pv_name = '{}-pv'.format(node_name)
+            if args.statefulset:
+                pvc_name = gen_statefulset_pvc_name(args.chain_name, i)
+            else:
+                pvc_name = gen_node_pvc_name(args.chain_name, i)
+            # the directory must exist on the host before the pod starts
+            path = os.path.join(device_path, node_name)
+            print('node {}: {}:{}'.format(i, host, path))
+            k8s_config.append(gen_node_pv(pv_name, host, path, args.capacity, args.storage_class))
+            k8s_config.append(gen_node_pvc(pvc_name, pv_name, args.request or args.capacity, args.storage_class))
+            pvc_names.append(pvc_name)
+
+    # write k8s_config to yaml file
+    yaml_ptah = os.path.join(work_dir, '{}-node-pvc.yaml'.format(args.chain_name))
+    write_k8s_config(yaml_ptah, k8s_config, timer)
+    if not args.statefulset:
+        print('pvc_names:', ','.join(pvc_names))
+
+    print("Done!!!")
+
+
+def run_subcmd_nfs_pvc(args, work_dir, timer):
     k8s_config = []
     nfs_pv = {
         'apiVersion': 'v1',
@@ -177,14 +359,12 @@ def run_subcmd_nfs_pvc(args, work_dir):
 
     # write k8s_config to yaml file
     yaml_ptah = os.path.join(work_dir, 'nfs-pvc.yaml')
-    print("yaml_ptah:{}", yaml_ptah)
-    with open(yaml_ptah, 'wt') as stream:
-        yaml.dump_all(k8s_config, stream, sort_keys=False)
+    write_k8s_config(yaml_ptah, k8s_config, timer)
 
     print("Done!!!")
 
 
-def run_subcmd_nas_pvc(args, work_dir):
+def run_subcmd_nas_pvc(args, work_dir, timer):
     k8s_config = []
     nas_pvc = {
         'kind': 'PersistentVolumeClaim',
@@ -208,9 +388,7 @@ def run_subcmd_nas_pvc(args, work_dir):
 
     # write k8s_config to yaml file
     yaml_ptah = os.path.join(work_dir, 'nas-pvc.yaml')
-    print("yaml_ptah:{}", yaml_ptah)
-    with open(yaml_ptah, 'wt') as stream:
-        yaml.dump_all(k8s_config, stream, sort_keys=False)
+    write_k8s_config(yaml_ptah, k8s_config, timer)
 
     print("Done!!!")
 
@@ -222,13 +400,32 @@ def main():
         SUBCMD_LOCAL_PVC: run_subcmd_local_pvc,
         SUBCMD_NFS_PVC: run_subcmd_nfs_pvc,
         SUBCMD_NAS_PVC: run_subcmd_nas_pvc,
+        SUBCMD_NODE_PVC: run_subcmd_node_pvc,
     }
     work_dir = os.path.abspath(os.curdir)
-    funcs_router[args.subcmd](args, work_dir)
+    # time of the phases of this run
+    from phase_timer import PhaseTimer
+    timer = PhaseTimer()
+    success = False
+    try:
+        if args.profile:
+            from phase_timer import run_profiled
+            run_profiled(work_dir, 'create_pvc-{}'.format(args.subcmd), funcs_router[args.subcmd], args, work_dir, timer)
+        else:
+            funcs_router[args.subcmd](args, work_dir, timer)
+        success = True
+    finally:
+        if args.profile or args.metrics_file:
+            print(timer.report())
+        if args.metrics_file:
+            from phase_timer import write_metrics
+            write_metrics(args.metrics_file, timer, 'create_pvc', {'subcmd': args.subcmd}, success)
+            print('metrics:', os.path.abspath(args.metrics_file))
 
 
 if __name__ == '__main__':
     SUBCMD_LOCAL_PVC = 'local_pvc'
     SUBCMD_NFS_PVC = 'nfs_pvc'
     SUBCMD_NAS_PVC = 'nas_pvc'
+    SUBCMD_NODE_PVC = 'node_pvc'
     main()
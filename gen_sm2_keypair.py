@@ -2,14 +2,76 @@
 # -*- coding:utf-8 -*-
 # pylint: disable=missing-docstring
 
+import argparse
+import json
 import os
-from pysmx.SM2 import generate_keypair
-from pysmx.SM3 import hash_msg
+import re
+import shutil
+import sys
+
+# only names of the backends, they are loaded when a key is generated
+from sm_crypto import BACKENDS, BACKEND_AUTO
+
+
+INDEX_FILE_NAME = 'keys-index.json'
+
+ADDRESS_PATTERN = re.compile(r'^0x[0-9a-f]{40}$')
+
+KEY_FILES = ['node_key', 'node_address', 'key_id']
+
+
+def str_to_bool(value):
+    if isinstance(value, bool):
+        return value
+    if value.lower() == 'false':
+        return False
+    elif value.lower() == 'true':
+        return True
+    raise ValueError(f'{value} is not a valid boolean value')
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--work_dir', default='.', help='The output director of keys.')
+
+    parser.add_argument(
+        '--count',
+        type=int,
+        help='Generate keys for this many nodes, and write {} mapping node index to address.'.format(INDEX_FILE_NAME))
+
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        help='Number of processes to generate keys, 0 means the number of CPUs.')
+
+    parser.add_argument(
+        '--backend',
+        default=BACKEND_AUTO,
+        choices=[BACKEND_AUTO] + list(BACKENDS),
+        help='Crypto backend of SM2/SM3, auto picks openssl if it loads, otherwise pysmx.')
+
+    parser.add_argument(
+        '--profile',
+        type=str_to_bool,
+        default=False,
+        help='Run under cProfile and tracemalloc, write the reports to work_dir and print the time of each phase')
+
+    parser.add_argument(
+        '--metrics_file',
+        help='Write the time of each phase to this file in Prometheus text format.')
+
+    args = parser.parse_args()
+    return args
 
 
 def gen_sm2_keypair(work_dir, chain_name):
-    pk, sk = generate_keypair()
-    addr = '0x'+hash_msg(pk)[24:]
+    from sm_crypto import get_backend, address_of
+    backend = get_backend()
+    pk, sk = backend.generate_keypair()
+    addr = address_of(backend, pk)
     path = os.path.join(work_dir, 'cita-cloud/{}/node_key'.format(chain_name))
     with open(path, 'wt') as stream:
         stream.write('0x'+sk.hex())
@@ -19,29 +81,159 @@ def gen_sm2_keypair(work_dir, chain_name):
     return addr
 
 
-def main():
-    pk, sk = generate_keypair()
-    address = '0x'+hash_msg(pk)[24:]
+# return (address, private key) of a new keypair
+def gen_address_key(backend_name):
+    from sm_crypto import get_backend, address_of
+    backend = get_backend(backend_name)
+    pk, sk = backend.generate_keypair()
+    return address_of(backend, pk), '0x'+sk.hex()
 
-    print("address:", address)
 
-    current_dir = os.path.abspath(os.curdir)
-    target_dir = os.path.join(current_dir, address)
-    if not os.path.exists(target_dir):
-        os.makedirs(target_dir)
+def write_key_dir(work_dir, address, node_key):
+    # write into a temp dir and rename it, so a crashed run never leaves a half-written key dir
+    target_dir = os.path.join(work_dir, address)
+    tmp_dir = os.path.join(work_dir, '.{}.tmp'.format(address))
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
 
-    path = os.path.join(target_dir, 'node_key')
+    path = os.path.join(tmp_dir, 'node_key')
     with open(path, 'wt') as stream:
-        stream.write('0x'+sk.hex())
+        stream.write(node_key)
 
-    path = os.path.join(target_dir, 'node_address')
+    path = os.path.join(tmp_dir, 'node_address')
     with open(path, 'wt') as stream:
         stream.write(address)
-    
-    path = os.path.join(target_dir, 'key_id')
+
+    path = os.path.join(tmp_dir, 'key_id')
     with open(path, 'wt') as stream:
         stream.write("1")
 
+    os.rename(tmp_dir, target_dir)
+    return target_dir
+
+
+def is_key_dir(work_dir, address):
+    if not ADDRESS_PATTERN.match(address):
+        return False
+    return all(os.path.isfile(os.path.join(work_dir, address, name)) for name in KEY_FILES)
+
+
+def load_index(index_path):
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path, 'rt') as stream:
+        return {int(i): address for i, address in json.load(stream).items()}
+
+
+def save_index(index_path, index):
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'wt') as stream:
+        json.dump({str(i): index[i] for i in sorted(index)}, stream, indent=2)
+    os.replace(tmp_path, index_path)
+
+
+def gen_keys(work_dir, count, jobs, backend_name, timer=None):
+    if timer is None:
+        from phase_timer import PhaseTimer
+        timer = PhaseTimer()
+    index_path = os.path.join(work_dir, INDEX_FILE_NAME)
+    with timer.phase('load_index'):
+        index = {}
+        for i, address in load_index(index_path).items():
+            if i < count and is_key_dir(work_dir, address):
+                index[i] = address
+                continue
+            # indexed by a crashed run before its key dir was renamed into place
+            tmp_dir = os.path.join(work_dir, '.{}.tmp'.format(address))
+            if ADDRESS_PATTERN.match(address) and os.path.isdir(tmp_dir):
+                shutil.rmtree(tmp_dir)
+        skipped = len(index)
+        missing = [i for i in range(count) if i not in index]
+    with timer.phase('write'):
+        save_index(index_path, index)
+    print('existing keys: {}, keys to generate: {}'.format(skipped, len(missing)))
+    timer.set('existing_keys', skipped)
+    timer.set('generated_keys', len(missing))
+
+    # index the address before its key dir appears, so every key dir of this batch is
+    # in the index, and key dirs of other runs in work_dir are never taken as ours
+    def add_key(i, address, node_key):
+        with timer.phase('write'):
+            index[i] = address
+            save_index(index_path, index)
+            write_key_dir(work_dir, address, node_key)
+        print('node {} address: {}'.format(i, address))
+
+    if jobs <= 1:
+        for i in missing:
+            with timer.phase('generate'):
+                address, node_key = gen_address_key(backend_name)
+            add_key(i, address, node_key)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            keys = executor.map(gen_address_key, [backend_name] * len(missing))
+            for i in missing:
+                # time waiting for the workers
+                with timer.phase('generate'):
+                    address, node_key = next(keys)
+                add_key(i, address, node_key)
+    return index
+
+
+def main():
+    args = parse_arguments()
+    work_dir = os.path.abspath(args.work_dir)
+    if not os.path.exists(work_dir):
+        os.makedirs(work_dir)
+
+    from phase_timer import PhaseTimer
+    timer = PhaseTimer()
+    success = False
+    try:
+        if args.profile:
+            from phase_timer import run_profiled
+            run_profiled(work_dir, 'gen_sm2_keypair', run, args, work_dir, timer)
+        else:
+            run(args, work_dir, timer)
+        success = True
+    finally:
+        if args.profile or args.metrics_file:
+            print(timer.report())
+        if args.metrics_file:
+            from phase_timer import write_metrics
+            write_metrics(args.metrics_file, timer, 'gen_sm2_keypair', {'backend': args.backend}, success)
+            print('metrics:', os.path.abspath(args.metrics_file))
+
+
+def run(args, work_dir, timer):
+    from sm_crypto import CryptoBackendError, get_backend
+    try:
+        # resolve auto once, instead of in every worker process
+        backend_name = get_backend(args.backend).name
+    except CryptoBackendError as e:
+        print(e)
+        sys.exit(1)
+    print("crypto backend:", backend_name)
+
+    if args.count is not None:
+        if args.count <= 0:
+            print('count must be positive')
+            sys.exit(1)
+        jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+        gen_keys(work_dir, args.count, jobs, backend_name, timer)
+        print('index:', os.path.join(work_dir, INDEX_FILE_NAME))
+        return
+
+    with timer.phase('generate'):
+        address, node_key = gen_address_key(backend_name)
+
+    print("address:", address)
+
+    with timer.phase('write'):
+        write_key_dir(work_dir, address, node_key)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# pylint: disable=missing-docstring
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+from cita_cloud_operator import InvalidChainSpec
+
+
+IMAGE_LOCK_VERSION = 1
+
+DIGEST_PATTERN = 'sha256:[0-9a-f]{64}'
+
+
+def load_image_lock(path):
+    """Return {image: digest} of the lockfile at path, empty if it does not exist."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'rt') as stream:
+            data = json.load(stream)
+    except (OSError, ValueError) as e:
+        raise InvalidChainSpec('load image lock {} failed: {}'.format(path, e))
+    if data.get('version') != IMAGE_LOCK_VERSION or not isinstance(data.get('images'), dict):
+        raise InvalidChainSpec('image lock {} is not of version {}'.format(path, IMAGE_LOCK_VERSION))
+    for image, digest in data['images'].items():
+        if not re.fullmatch(DIGEST_PATTERN, str(digest)):
+            raise InvalidChainSpec('invalid digest of {} in image lock {}: {}'.format(image, path, digest))
+    return data['images']
+
+
+def save_image_lock(path, images):
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wt') as stream:
+        json.dump({'version': IMAGE_LOCK_VERSION, 'images': dict(sorted(images.items()))}, stream, indent=2)
+    os.replace(tmp_path, path)
+
+
+# repository of an image reference, without tag or digest
+def image_repository(image):
+    image = image.split('@')[0]
+    name, _, tag = image.rpartition(':')
+    # a colon before the last slash belongs to the port of registry
+    if name and '/' not in tag:
+        return name
+    return image
+
+
+# digest of an image pulled by the local docker, no registry is accessed
+def resolve_local_digest(image):
+    try:
+        output = subprocess.run(
+            ['docker', 'image', 'inspect', '--format', '{{json .RepoDigests}}', image],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    except OSError as e:
+        raise InvalidChainSpec('run docker failed: {}'.format(e))
+    except subprocess.CalledProcessError as e:
+        raise InvalidChainSpec('inspect {} failed: {}'.format(image, e.stderr.decode().strip()))
+    repository = image_repository(image)
+    for repo_digest in json.loads(output.stdout.decode()) or []:
+        repo, _, digest = repo_digest.partition('@')
+        if repo == repository or repo.endswith('/' + repository):
+            return digest
+    raise InvalidChainSpec('no digest of {} in local docker, it must be pulled from a registry'.format(image))
+
+
+# images of the pods in yaml files
+def find_images(paths):
+    import yaml
+    images = []
+    for path in paths:
+        with open(path, 'rt') as stream:
+            for obj in yaml.safe_load_all(stream):
+                pod_spec = ((obj or {}).get('spec') or {}).get('template', {}).get('spec', {})
+                for container in pod_spec.get('initContainers', []) + pod_spec.get('containers', []):
+                    if container['image'] not in images:
+                        images.append(container['image'])
+    return images
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--lock', default='images.lock.json', help='The image lockfile.')
+
+    subparsers = parser.add_subparsers(
+        dest='subcmd', title='subcommands', help='additional help')
+
+    pimages = subparsers.add_parser(
+        'images', help='Print the images used in yaml files generated by cita_cloud_operator.py, one per line.')
+
+    pimages.add_argument(
+        'files', nargs='+', help='Yaml files.')
+
+    presolve = subparsers.add_parser(
+        'resolve', help='Lock images to the digests of the local docker, without accessing registries.')
+
+    presolve.add_argument(
+        'images', nargs='+', help='Images to lock.')
+
+    pset = subparsers.add_parser(
+        'set', help='Lock an image to a digest got elsewhere, like `crane digest`.')
+
+    pset.add_argument(
+        'image', help='Image to lock.')
+
+    pset.add_argument(
+        'digest', help='Digest like sha256:....')
+
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_arguments()
+    if args.subcmd == 'images':
+        for image in find_images(args.files):
+            # pinned images are already locked
+            if '@' not in image:
+                print(image)
+        return
+    if args.subcmd is None:
+        return
+
+    try:
+        images = load_image_lock(args.lock)
+        if args.subcmd == 'resolve':
+            for image in args.images:
+                images[image] = resolve_local_digest(image)
+                print('{}: {}'.format(image, images[image]))
+        elif args.subcmd == 'set':
+            if not re.fullmatch(DIGEST_PATTERN, args.digest):
+                raise InvalidChainSpec('invalid digest: {}'.format(args.digest))
+            images[args.image] = args.digest
+    except InvalidChainSpec as e:
+        print(e)
+        sys.exit(1)
+    save_image_lock(args.lock, images)
+    print('image lock:', os.path.abspath(args.lock))
+
+
+if __name__ == '__main__':
+    main()
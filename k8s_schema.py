@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# pylint: disable=missing-docstring
+
+import argparse
+import hashlib
+import json
+import marshal
+import os
+import sys
+
+from cita_cloud_operator import OperatorError
+
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'k8s-schemas.json')
+
+# bump it when the generated code of same schemas changes
+CODEGEN_VERSION = 1
+
+REF_PREFIX = '#/definitions/'
+
+# definitions which are not what their type says, as in kubectl
+INT_OR_STRING = 'io.k8s.apimachinery.pkg.util.intstr.IntOrString'
+QUANTITY = 'io.k8s.apimachinery.pkg.api.resource.Quantity'
+
+INT32_MIN = -2 ** 31
+INT32_MAX = 2 ** 31 - 1
+
+
+class SchemaValidationError(OperatorError):
+    def __init__(self, errors):
+        super().__init__('\n'.join(errors))
+        self.errors = errors
+
+
+def gen_validator_cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'cita_cloud_operator')
+
+
+# a path is (parent path, key) from the root (), only formatted when there is an error
+def format_path(path):
+    keys = []
+    while path:
+        path, key = path
+        keys.append(key)
+    text = ''
+    for key in reversed(keys):
+        text += '[{}]'.format(key) if isinstance(key, int) else '.{}'.format(key)
+    return text.lstrip('.') or '.'
+
+
+def func_name(definition_name):
+    return 'validate_' + definition_name.replace('.', '_')
+
+
+# Turn each definition into a python function validate_xxx(value, path, errors),
+# which appends (path, message) of every error to errors.
+class CodeGenerator:
+    def __init__(self, definitions):
+        self.definitions = definitions
+        self.lines = []
+        self.constants = []
+        self.var_count = 0
+
+    def var(self, prefix):
+        self.var_count += 1
+        return '{}{}'.format(prefix, self.var_count)
+
+    def constant(self, prefix, values):
+        name = self.var(prefix)
+        self.constants.append('{} = frozenset({!r})'.format(name, sorted(values)))
+        return name
+
+    def emit(self, indent, line):
+        self.lines.append('    ' * indent + line)
+
+    def error(self, indent, path, message):
+        self.emit(indent, 'errors.append(({}, {!r}))'.format(path, message))
+
+    def gen_check(self, schema, value, path, indent):
+        if '$ref' in schema:
+            name = schema['$ref'][len(REF_PREFIX):]
+            if name not in self.definitions:
+                raise ValueError('unknown definition {}'.format(name))
+            if name == INT_OR_STRING:
+                self.emit(indent, 'if not isinstance({0}, (int, str)) or isinstance({0}, bool):'.format(value))
+                self.error(indent + 1, path, 'expected integer or string')
+            elif name == QUANTITY:
+                self.emit(indent, 'if not isinstance({0}, (int, float, str)) or isinstance({0}, bool):'.format(value))
+                self.error(indent + 1, path, 'expected quantity')
+            else:
+                self.emit(indent, '{}({}, {}, errors)'.format(func_name(name), value, path))
+            return
+
+        schema_type = schema.get('type')
+        if schema_type == 'string':
+            self.emit(indent, 'if not isinstance({}, str):'.format(value))
+            self.error(indent + 1, path, 'expected string')
+            if 'enum' in schema:
+                self.emit(indent, 'elif {} not in {}:'.format(value, self.constant('ENUM_', schema['enum'])))
+                self.error(indent + 1, path, 'expected one of {}'.format(', '.join(schema['enum'])))
+        elif schema_type == 'integer':
+            self.emit(indent, 'if not isinstance({0}, int) or isinstance({0}, bool):'.format(value))
+            self.error(indent + 1, path, 'expected integer')
+            if schema.get('format') == 'int32':
+                self.emit(indent, 'elif not {} <= {} <= {}:'.format(INT32_MIN, value, INT32_MAX))
+                self.error(indent + 1, path, 'out of range of int32')
+        elif schema_type == 'number':
+            self.emit(indent, 'if not isinstance({0}, (int, float)) or isinstance({0}, bool):'.format(value))
+            self.error(indent + 1, path, 'expected number')
+        elif schema_type == 'boolean':
+            self.emit(indent, 'if not isinstance({}, bool):'.format(value))
+            self.error(indent + 1, path, 'expected boolean')
+        elif schema_type == 'array':
+            index, item = self.var('index'), self.var('item')
+            self.emit(indent, 'if not isinstance({}, list):'.format(value))
+            self.error(indent + 1, path, 'expected array')
+            self.emit(indent, 'else:')
+            self.emit(indent + 1, 'for {}, {} in enumerate({}):'.format(index, item, value))
+            self.gen_check(schema['items'], item, '({}, {})'.format(path, index), indent + 2)
+        elif schema_type == 'object' and 'additionalProperties' in schema:
+            key, item = self.var('key'), self.var('item')
+            self.emit(indent, 'if not isinstance({}, dict):'.format(value))
+            self.error(indent + 1, path, 'expected object')
+            self.emit(indent, 'else:')
+            self.emit(indent + 1, 'for {}, {} in {}.items():'.format(key, item, value))
+            self.gen_check(schema['additionalProperties'], item, '({}, {})'.format(path, key), indent + 2)
+        elif schema_type == 'object':
+            self.gen_object_check(schema, value, path, indent)
+        else:
+            raise ValueError('unsupported schema: {}'.format(schema))
+
+    def gen_object_check(self, schema, value, path, indent):
+        properties = schema.get('properties', {})
+        self.emit(indent, 'if not isinstance({}, dict):'.format(value))
+        self.error(indent + 1, path, 'expected object')
+        self.emit(indent, 'else:')
+        indent += 1
+        for name in schema.get('required', []):
+            self.emit(indent, 'if {}.get({!r}) is None:'.format(value, name))
+            self.error(indent + 1, '({}, {!r})'.format(path, name), 'required field is missing')
+        # unknown fields are errors, like kubectl apply --validate=strict
+        key, fields = self.var('key'), self.constant('FIELDS_', properties)
+        self.emit(indent, 'if not {}.keys() <= {}:'.format(value, fields))
+        self.emit(indent + 1, 'for {} in sorted({}.keys() - {}, key=str):'.format(key, value, fields))
+        self.error(indent + 2, '({}, {})'.format(path, key), 'unknown field')
+        for name in sorted(properties):
+            item = self.var('item')
+            # null is same as not set
+            self.emit(indent, '{} = {}.get({!r})'.format(item, value, name))
+            self.emit(indent, 'if {} is not None:'.format(item))
+            self.gen_check(properties[name], item, '({}, {!r})'.format(path, name), indent + 1)
+
+    def gen_definition(self, name):
+        self.emit(0, 'def {}(value, path, errors):'.format(func_name(name)))
+        self.gen_check(self.definitions[name], 'value', 'path', 1)
+        self.emit(0, '')
+
+    def gen_source(self):
+        kinds = {}
+        for name in sorted(self.definitions):
+            if name in (INT_OR_STRING, QUANTITY):
+                continue
+            self.gen_definition(name)
+            for gvk in self.definitions[name].get('x-kubernetes-group-version-kind', []):
+                api_version = '{}/{}'.format(gvk['group'], gvk['version']) if gvk['group'] else gvk['version']
+                kinds[(api_version, gvk['kind'])] = func_name(name)
+        self.emit(0, 'VALIDATORS = {')
+        for (api_version, kind), name in sorted(kinds.items()):
+            self.emit(1, '({!r}, {!r}): {},'.format(api_version, kind, name))
+        self.emit(0, '}')
+        return '\n'.join(self.constants + [''] + self.lines) + '\n'
+
+
+def gen_validators_source(schema_data):
+    return CodeGenerator(json.loads(schema_data)['definitions']).gen_source()
+
+
+class SchemaValidator:
+    def __init__(self, validators):
+        self.validators = validators
+
+    def validate(self, obj):
+        """Return the errors of obj as 'path: message' strings."""
+        errors = []
+        if not isinstance(obj, dict):
+            return ['.: expected object']
+        validate = self.validators.get((obj.get('apiVersion'), obj.get('kind')))
+        if validate is None:
+            return ['.: no schema of apiVersion {} kind {}'.format(obj.get('apiVersion'), obj.get('kind'))]
+        validate(obj, (), errors)
+        return ['{}: {}'.format(format_path(path), message) for path, message in errors]
+
+    def collect_errors(self, objects):
+        """Return the errors of all objects as 'kind/name path: message' strings."""
+        errors = []
+        for obj in objects:
+            name = obj.get('metadata', {}).get('name') if isinstance(obj, dict) else None
+            kind = obj.get('kind') if isinstance(obj, dict) else None
+            for error in self.validate(obj):
+                errors.append('{}/{} {}'.format(kind, name, error))
+        return errors
+
+    def check(self, objects):
+        """Raise SchemaValidationError with the errors of all objects."""
+        errors = self.collect_errors(objects)
+        if errors:
+            raise SchemaValidationError(errors)
+
+
+_validators = {}
+
+
+def load_validator(schema_path=SCHEMA_PATH, cache_dir=None):
+    """Load the validator compiled from the schemas at schema_path.
+
+    The compiled code is cached in cache_dir, keyed by the content of schemas,
+    so only the first run after the schemas change pays for code generation.
+    """
+    with open(schema_path, 'rb') as stream:
+        schema_data = stream.read()
+    key = hashlib.sha256(schema_data + '{}:{}'.format(CODEGEN_VERSION, sys.implementation.cache_tag).encode('utf-8')).hexdigest()
+    if key in _validators:
+        return _validators[key]
+
+    if cache_dir is None:
+        cache_dir = gen_validator_cache_dir()
+    cache_path = os.path.join(cache_dir, 'k8s-validators-{}.bin'.format(key[:16]))
+    code = None
+    try:
+        with open(cache_path, 'rb') as stream:
+            code = marshal.load(stream)
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    if code is None:
+        code = compile(gen_validators_source(schema_data), '<k8s-validators>', 'exec')
+        # cache is an optimization, go on without it if it can not be written
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+            with open(tmp_path, 'wb') as stream:
+                marshal.dump(code, stream)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+
+    namespace = {}
+    exec(code, namespace)
+    validator = SchemaValidator(namespace['VALIDATORS'])
+    _validators[key] = validator
+    return validator
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(
+        dest='subcmd', title='subcommands', help='additional help')
+
+    pcheck = subparsers.add_parser(
+        'check', help='Check objects in yaml files against the bundled k8s schemas, report all errors.')
+
+    pcheck.add_argument(
+        'files', nargs='+', help='Yaml files to check.')
+
+    subparsers.add_parser(
+        'source', help='Print the python source generated from the bundled k8s schemas.')
+
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_arguments()
+    if args.subcmd == 'check':
+        import yaml
+        validator = load_validator()
+        count = 0
+        failed = False
+        for path in args.files:
+            with open(path, 'rt') as stream:
+                objects = [obj for obj in yaml.safe_load_all(stream) if obj]
+            count += len(objects)
+            try:
+                validator.check(objects)
+            except SchemaValidationError as e:
+                for error in e.errors:
+                    print('{}: {}'.format(path, error))
+                failed = True
+        if failed:
+            sys.exit(1)
+        print('{} objects checked, no errors'.format(count))
+    elif args.subcmd == 'source':
+        with open(SCHEMA_PATH, 'rb') as stream:
+            print(gen_validators_source(stream.read()), end='')
+
+
+if __name__ == '__main__':
+    main()
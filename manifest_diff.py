@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# pylint: disable=missing-docstring
+
+import os
+
+import yaml
+
+
+PATCH_TYPE_MERGE = 'merge'
+PATCH_TYPE_STRATEGIC = 'strategic'
+
+# patchMergeKey of the lists in the objects we generate
+# ports of containers are merged by containerPort, ports of services by port
+STRATEGIC_MERGE_KEYS = {
+    'containers': ['name'],
+    'initContainers': ['name'],
+    'volumes': ['name'],
+    'volumeMounts': ['mountPath'],
+    'env': ['name'],
+    'ports': ['containerPort', 'port'],
+}
+
+# a change of pod template restarts the pods of these kinds
+WORKLOAD_KINDS = ['Deployment', 'StatefulSet', 'DaemonSet']
+
+
+def object_key(obj):
+    return obj['kind'], obj['metadata']['name']
+
+
+def load_manifests(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rt') as stream:
+        return [obj for obj in yaml.safe_load_all(stream) if obj]
+
+
+def json_merge_patch(old, new):
+    """RFC 7386 merge patch which turns old into new."""
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return new
+    patch = {}
+    for key in old:
+        if key not in new:
+            patch[key] = None
+    for key, value in new.items():
+        if key not in old:
+            patch[key] = value
+        elif old[key] != value:
+            patch[key] = json_merge_patch(old[key], value)
+    return patch
+
+
+def find_merge_key(field, old, new):
+    items = old + new
+    if not items or not all(isinstance(item, dict) for item in items):
+        return None
+    for merge_key in STRATEGIC_MERGE_KEYS.get(field, []):
+        if all(merge_key in item for item in items):
+            old_keys = [item[merge_key] for item in old]
+            new_keys = [item[merge_key] for item in new]
+            if len(set(old_keys)) == len(old_keys) and len(set(new_keys)) == len(new_keys):
+                return merge_key
+    return None
+
+
+def strategic_list_patch(old, new, merge_key):
+    old_items = {item[merge_key]: item for item in old}
+    new_items = {item[merge_key]: item for item in new}
+    patch = []
+    for item in new:
+        key = item[merge_key]
+        if key not in old_items:
+            patch.append(item)
+        elif old_items[key] != item:
+            item_patch = strategic_merge_patch(old_items[key], item)
+            item_patch[merge_key] = key
+            patch.append(item_patch)
+    for key in old_items:
+        if key not in new_items:
+            patch.append({merge_key: key, '$patch': 'delete'})
+    return patch
+
+
+def strategic_merge_patch(old, new):
+    """Strategic merge patch which turns old into new.
+
+    Lists with a known merge key are patched item by item, other lists are replaced.
+    """
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return new
+    patch = {}
+    for key in old:
+        if key not in new:
+            patch[key] = None
+    for key, value in new.items():
+        if key not in old:
+            patch[key] = value
+            continue
+        old_value = old[key]
+        if old_value == value:
+            continue
+        if isinstance(old_value, list) and isinstance(value, list):
+            merge_key = find_merge_key(key, old_value, value)
+            if merge_key is None:
+                patch[key] = value
+                continue
+            patch[key] = strategic_list_patch(old_value, value, merge_key)
+            patch['$setElementOrder/{}'.format(key)] = [{merge_key: item[merge_key]} for item in value]
+        else:
+            patch[key] = strategic_merge_patch(old_value, value)
+    return patch
+
+
+def gen_patch(old, new, patch_type):
+    if patch_type == PATCH_TYPE_MERGE:
+        return json_merge_patch(old, new)
+    return strategic_merge_patch(old, new)
+
+
+def will_roll(old, new):
+    """Whether applying new over old restarts pods."""
+    if new is not None and new['kind'] not in WORKLOAD_KINDS:
+        return False
+    if old is None or new is None:
+        return True
+    return old['spec'].get('template') != new['spec'].get('template')
+
+
+def diff_manifests(old_objects, new_objects, patch_type):
+    """Diff objects by kind and name.
+
+    Returns (changes, rolls), changes are the actions to turn old_objects into new_objects,
+    rolls is whether any pod restarts.
+    """
+    old_by_key = {object_key(obj): obj for obj in old_objects}
+    new_keys = set()
+    changes = []
+    rolls = False
+    for new in new_objects:
+        key = object_key(new)
+        new_keys.add(key)
+        old = old_by_key.get(key)
+        if old is None:
+            changes.append({'action': 'create', 'kind': key[0], 'name': key[1], 'object': new})
+        elif old != new:
+            changes.append({'action': 'patch', 'kind': key[0], 'name': key[1], 'patchType': patch_type, 'patch': gen_patch(old, new, patch_type)})
+        else:
+            continue
+        rolls = rolls or will_roll(old, new)
+    for old in old_objects:
+        key = object_key(old)
+        if key not in new_keys:
+            changes.append({'action': 'delete', 'kind': key[0], 'name': key[1]})
+            rolls = rolls or old['kind'] in WORKLOAD_KINDS
+    return changes, rolls
@@ -0,0 +1,146 @@
+# -*- coding:utf-8 -*-
+# pylint: disable=missing-docstring
+
+import contextlib
+import os
+import re
+import time
+
+
+METRIC_PREFIX = 'citacloud_generation'
+
+PROFILE_TOP_FUNCTIONS = 50
+
+PROFILE_TOP_LINES = 30
+
+
+class PhaseTimer:
+    """Wall time and count of the named phases of a run, and other values of it.
+
+    A phase may be entered many times, like the build of each node, the times are summed.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # phase name: [seconds, count], in order of first use
+        self.phases = {}
+        self.values = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds, count=1):
+        phase = self.phases.setdefault(name, [0.0, 0])
+        phase[0] += seconds
+        phase[1] += count
+
+    # phases timed in a worker process
+    def merge(self, phases):
+        for name, (seconds, count) in phases.items():
+            self.add(name, seconds, count)
+
+    def set(self, name, value):
+        self.values[name] = value
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def report(self):
+        lines = ['phases:']
+        for name, (seconds, count) in self.phases.items():
+            lines.append('  {}: {:.4f}s, {} times'.format(name, seconds, count))
+        lines.append('  total: {:.4f}s'.format(self.elapsed()))
+        return '\n'.join(lines)
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels):
+    return ','.join('{}="{}"'.format(name, escape_label_value(value)) for name, value in labels.items())
+
+
+def format_metrics(timer, tool, labels=None, success=True):
+    """Metrics of the run in Prometheus text format, for the textfile collector of node_exporter."""
+    labels = dict({'tool': tool}, **(labels or {}))
+    run_labels = format_labels(labels)
+    lines = []
+
+    def family(name, help_text):
+        lines.append('# HELP {}_{} {}'.format(METRIC_PREFIX, name, help_text))
+        lines.append('# TYPE {}_{} gauge'.format(METRIC_PREFIX, name))
+
+    family('phase_seconds', 'Wall time spent in each phase of the last run.')
+    for name, (seconds, _) in timer.phases.items():
+        lines.append('{}_phase_seconds{{{},phase="{}"}} {:.6f}'.format(METRIC_PREFIX, run_labels, name, seconds))
+    family('phase_calls', 'Times each phase was entered in the last run.')
+    for name, (_, count) in timer.phases.items():
+        lines.append('{}_phase_calls{{{},phase="{}"}} {}'.format(METRIC_PREFIX, run_labels, name, count))
+    family('run_seconds', 'Wall time of the last run.')
+    lines.append('{}_run_seconds{{{}}} {:.6f}'.format(METRIC_PREFIX, run_labels, timer.elapsed()))
+    family('run_success', 'Whether the last run succeeded.')
+    lines.append('{}_run_success{{{}}} {}'.format(METRIC_PREFIX, run_labels, int(success)))
+    family('run_timestamp_seconds', 'Unix time when the last run finished.')
+    lines.append('{}_run_timestamp_seconds{{{}}} {:.3f}'.format(METRIC_PREFIX, run_labels, time.time()))
+    for name, value in timer.values.items():
+        name = re.sub('[^a-zA-Z0-9_]', '_', name)
+        family(name, 'Value {} of the last run.'.format(name))
+        lines.append('{}_{}{{{}}} {}'.format(METRIC_PREFIX, name, run_labels, value))
+    return '\n'.join(lines) + '\n'
+
+
+# the collector may read at any time, so write to a temp file and rename it
+def write_metrics(path, timer, tool, labels=None, success=True):
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wt') as stream:
+        stream.write(format_metrics(timer, tool, labels, success))
+    os.replace(tmp_path, path)
+
+
+def gen_profile_paths(work_dir, name):
+    return (
+        os.path.join(work_dir, '{}-profile.prof'.format(name)),
+        os.path.join(work_dir, '{}-profile.txt'.format(name)),
+        os.path.join(work_dir, '{}-memory.txt'.format(name)),
+    )
+
+
+def run_profiled(work_dir, name, func, *args):
+    """Run func under cProfile and tracemalloc, and write the reports to work_dir.
+
+    The reports are written even if func fails or exits. Only this process is
+    profiled, work done in worker processes is not in the reports.
+    """
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    prof_path, profile_path, memory_path = gen_profile_paths(work_dir, name)
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        return func(*args)
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        profiler.dump_stats(prof_path)
+        with open(profile_path, 'wt') as stream:
+            stats = pstats.Stats(profiler, stream=stream)
+            stats.sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+        with open(memory_path, 'wt') as stream:
+            stream.write('current: {} bytes\npeak: {} bytes\n\n'.format(current, peak))
+            for stat in snapshot.statistics('lineno')[:PROFILE_TOP_LINES]:
+                stream.write('{}\n'.format(stat))
+        print('profile:', prof_path)
+        print('profile report:', profile_path)
+        print('memory report:', memory_path)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# pylint: disable=missing-docstring
+
+import bisect
+import json
+import os
+
+from cita_cloud_operator import InvalidChainSpec
+
+
+PORT_ALLOCATIONS_FILE_NAME = 'port-allocations.json'
+
+PORT_ALLOCATIONS_VERSION = 1
+
+MAX_PORT = 65535
+
+
+class PortConflict(InvalidChainSpec):
+    pass
+
+
+def gen_port_allocations_path(work_dir):
+    return os.path.join(work_dir, PORT_ALLOCATIONS_FILE_NAME)
+
+
+def parse_port_range(value):
+    try:
+        low, high = (int(x) for x in value.split('-'))
+    except ValueError:
+        raise InvalidChainSpec('The port_range is invalid: {}'.format(value))
+    if not 0 < low <= high <= MAX_PORT:
+        raise InvalidChainSpec('The port_range is invalid: {}'.format(value))
+    return low, high
+
+
+def format_owner(owner):
+    return '{}/{}'.format(*owner)
+
+
+# Blocks of ports [start, end) sorted by start, owner of a block is (chain_name, node index),
+# or (chain_name, 'gateway') for the NodePort of the RPC gateway of a chain.
+# Blocks never overlap, so the block which may contain a port is found by bisect on starts.
+class PortAllocator:
+    def __init__(self, blocks=()):
+        self._set_blocks(blocks)
+
+    def _set_blocks(self, blocks):
+        self._starts = []
+        self._ends = []
+        self._owners = []
+        # owners are not compared, node indexes and 'gateway' do not sort together
+        for start, end, owner in sorted(blocks, key=lambda block: block[:2]):
+            if start <= 0 or end - 1 > MAX_PORT:
+                raise PortConflict('ports {}-{} of {} are out of range'.format(start, end - 1, format_owner(owner)))
+            if self._ends and start < self._ends[-1]:
+                raise PortConflict('ports {}-{} of {} overlap with {}'.format(start, end - 1, format_owner(owner), format_owner(self._owners[-1])))
+            self._starts.append(start)
+            self._ends.append(end)
+            self._owners.append(owner)
+
+    def blocks(self):
+        return list(zip(self._starts, self._ends, self._owners))
+
+    # owners of the blocks overlapping [start, end)
+    def overlaps(self, start, end):
+        lo = bisect.bisect_right(self._ends, start)
+        hi = bisect.bisect_left(self._starts, end)
+        return self._owners[lo:hi]
+
+    # add blocks of (start, end, owner), all or none of them
+    def reserve(self, blocks):
+        self._set_blocks(self.blocks() + list(blocks))
+
+    def release(self, predicate):
+        self._set_blocks(block for block in self.blocks() if not predicate(block[2]))
+
+    def allocate(self, owners, size, low, high):
+        """Allocate a block of size ports in [low, high] for each owner.
+
+        Blocks are placed first fit in one pass over the gaps between existing blocks.
+        Returns start ports in order of owners.
+        """
+        new_blocks = []
+        i = bisect.bisect_right(self._ends, low)
+        cursor = low
+        for owner in owners:
+            while True:
+                is_last_gap = i >= len(self._starts) or self._starts[i] > high
+                gap_end = high + 1 if is_last_gap else self._starts[i]
+                if cursor + size <= gap_end:
+                    break
+                if is_last_gap:
+                    raise PortConflict('no free ports in {}-{} for {}, {} ports are needed'.format(low, high, format_owner(owner), size))
+                cursor = max(cursor, self._ends[i])
+                i += 1
+            new_blocks.append((cursor, cursor + size, owner))
+            cursor += size
+
+        self.reserve(new_blocks)
+        return [start for start, _, _ in new_blocks]
+
+    def to_dict(self):
+        return {
+            'version': PORT_ALLOCATIONS_VERSION,
+            'allocations': [
+                {'chain_name': owner[0], 'node': owner[1], 'start': start, 'size': end - start}
+                for start, end, owner in self.blocks()
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('version') != PORT_ALLOCATIONS_VERSION:
+            raise InvalidChainSpec('unsupported version of port allocations: {}'.format(data.get('version')))
+        return cls((a['start'], a['start'] + a['size'], (a['chain_name'], a['node'])) for a in data['allocations'])
+
+
+def load_port_allocator(path):
+    if not os.path.exists(path):
+        return PortAllocator()
+    try:
+        with open(path, 'rt') as stream:
+            return PortAllocator.from_dict(json.load(stream))
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        raise InvalidChainSpec('load port allocations {} failed: {}'.format(path, e))
+
+
+def save_port_allocator(path, allocator):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wt') as stream:
+        json.dump(allocator.to_dict(), stream, indent=2)
+    os.replace(tmp_path, path)
+
+
+def gen_node_port_blocks(spec):
+    return [(start, start + spec.node_port_span, (spec.chain_name, i)) for i, start in enumerate(spec.node_ports)]
+
+
+def gen_gateway_port_blocks(spec):
+    if not spec.rpc_gateway or spec.rpc_gateway_port is None:
+        return []
+    return [(spec.rpc_gateway_port, spec.rpc_gateway_port + 1, (spec.chain_name, 'gateway'))]
+
+
+# ports of the nodes and the RPC gateway of one chain must not overlap either, with or without an allocations file;
+# only overlaps are checked, ports out of range are left to k8s as before
+def check_node_ports(spec):
+    blocks = sorted(gen_node_port_blocks(spec) + gen_gateway_port_blocks(spec), key=lambda block: block[:2])
+    for (_, previous_end, previous_owner), (start, end, owner) in zip(blocks, blocks[1:]):
+        if start < previous_end:
+            raise PortConflict('ports {}-{} of {} overlap with {}'.format(start, end - 1, format_owner(owner), format_owner(previous_owner)))
+
+
+def assign_node_ports(spec, path, port_range):
+    """Record the ports of the nodes of spec in the allocations file at path.
+
+    Explicit node_ports are checked against the ports of other chains and nodes.
+    The rpc_gateway_port, if set, is reserved in the same way as a block of one port.
+    Without node_ports, each node keeps its previous block if the size is unchanged,
+    other nodes get new blocks in port_range, and spec.node_ports is filled.
+    Raises PortConflict if ports overlap or run out.
+    """
+    import fcntl
+
+    low, high = port_range
+    size = spec.node_port_span
+    chain_name = spec.chain_name
+    # one process or thread updates the file at a time; the lock is on a file of its own,
+    # because save_port_allocator replaces path with a new file, and a lock on the old one is lost
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        allocator = load_port_allocator(path)
+        previous = {owner[1]: (start, end) for start, end, owner in allocator.blocks() if owner[0] == chain_name}
+        allocator.release(lambda owner: owner[0] == chain_name)
+        allocator.reserve(gen_gateway_port_blocks(spec))
+
+        if spec.node_ports:
+            allocator.reserve(gen_node_port_blocks(spec))
+        else:
+            node_ports = {}
+            for i in range(spec.peers_count):
+                start, end = previous.get(i, (None, None))
+                if start is not None and end - start == size and low <= start and end - 1 <= high and not allocator.overlaps(start, end):
+                    node_ports[i] = start
+            allocator.reserve((start, start + size, (chain_name, i)) for i, start in node_ports.items())
+            missing = [i for i in range(spec.peers_count) if i not in node_ports]
+            starts = allocator.allocate([(chain_name, i) for i in missing], size, low, high)
+            node_ports.update(zip(missing, starts))
+            spec.node_ports = [node_ports[i] for i in range(spec.peers_count)]
+
+        save_port_allocator(path, allocator)
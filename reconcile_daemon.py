@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# pylint: disable=missing-docstring
+
+import collections
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cita_cloud_operator import ChainSpec, OperatorError, InvalidChainSpec, AtomicFileWriter, write_chain
+from port_allocator import assign_node_ports, gen_port_allocations_path, parse_port_range
+
+
+# other files may sit beside the specs, like the service config they refer to
+SPEC_FILE_SUFFIXES = ('.chain.toml', '.chain.yaml', '.chain.yml')
+
+STATUS_FILE_NAME = '.reconcile-status.json'
+
+
+# (mtime, size) of each spec file in watch_dir
+def scan_spec_files(watch_dir):
+    files = {}
+    for entry in os.scandir(watch_dir):
+        if entry.name.startswith('.') or not entry.name.endswith(SPEC_FILE_SUFFIXES):
+            continue
+        if not entry.is_file():
+            continue
+        stat = entry.stat()
+        files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+# (mtime, size) of a file, None if it does not exist
+def stat_file(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+# files read by the chain of a spec besides the spec file itself
+def gen_spec_dependencies(args):
+    paths = [args.service_config]
+    if args.image_lock:
+        paths.append(args.image_lock)
+    return {path: stat_file(path) for path in paths}
+
+
+class ReconcileStats:
+    def __init__(self):
+        self.reconciles = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.latency_last = None
+
+    def observe(self, latency, ok):
+        self.reconciles += 1
+        if not ok:
+            self.errors += 1
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.latency_last = latency
+
+    def to_dict(self):
+        return {
+            'reconciles': self.reconciles,
+            'errors': self.errors,
+            'latency_seconds': {
+                'last': self.latency_last,
+                'avg': self.latency_sum / self.reconciles if self.reconciles else None,
+                'max': self.latency_max,
+            },
+        }
+
+
+# Reconcile the chain of each spec file in watch_dir into work_dir/{chain_name}.
+#
+# A changed spec file waits in pending until it stays unchanged for debounce seconds,
+# then it is queued, and reconciled when one of the workers is free.
+# A change of the service config or image lock of a spec is a change of the spec.
+# Latency of a reconcile is from the first change seen to the end of reconcile.
+# Ports of all chains are recorded in port-allocations.json of work_dir,
+# nodes of a spec without node_ports get ports from port_range.
+class Reconciler:
+    def __init__(self, watch_dir, work_dir, debounce=2.0, workers=4, jobs=1, clock=time.monotonic, port_range=(30000, 32767), validate=False):
+        self.watch_dir = watch_dir
+        self.work_dir = work_dir
+        self.port_range = port_range
+        self.validate = validate
+        self.debounce = debounce
+        self.workers = workers
+        self.jobs = jobs
+        self.clock = clock
+        # path -> (mtime, size) of last scan
+        self.files = {}
+        # path -> {dependency path: (mtime, size) when last reconciled}
+        self.dependencies = {}
+        # path -> (first change, last change), waiting for debounce
+        self.pending = {}
+        # path -> first change, ready to reconcile
+        self.queue = collections.OrderedDict()
+        # path -> (future, first change)
+        self.running = {}
+        # path -> result of last reconcile
+        self.results = {}
+        # chain_name -> path, one chain must be defined by only one spec file
+        self.chain_owners = {}
+        self.chain_owners_lock = threading.Lock()
+        self.stats = ReconcileStats()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def queue_depth(self):
+        return len(self.pending) + len(self.queue)
+
+    def mark_changed(self, path, now):
+        first_change = self.pending[path][0] if path in self.pending else now
+        self.pending[path] = (first_change, now)
+
+    def scan(self):
+        now = self.clock()
+        files = scan_spec_files(self.watch_dir)
+        for path, stat in files.items():
+            if self.files.get(path) != stat:
+                self.mark_changed(path, now)
+        for path, dependencies in self.dependencies.items():
+            for dependency, stat in dependencies.items():
+                current = stat_file(dependency)
+                if current != stat:
+                    dependencies[dependency] = current
+                    self.mark_changed(path, now)
+        for path in self.files.keys() - files.keys():
+            self.pending.pop(path, None)
+            self.queue.pop(path, None)
+            self.results.pop(path, None)
+            self.dependencies.pop(path, None)
+            with self.chain_owners_lock:
+                for chain_name in [k for k, v in self.chain_owners.items() if v == path]:
+                    del self.chain_owners[chain_name]
+            print('spec removed: {}, generated files are kept'.format(path))
+        self.files = files
+
+    def collect(self):
+        for path, (future, first_change) in list(self.running.items()):
+            if not future.done():
+                continue
+            del self.running[path]
+            ok, message, dependencies = future.result()
+            if path in self.files:
+                self.dependencies[path] = dependencies
+            latency = self.clock() - first_change
+            self.stats.observe(latency, ok)
+            self.results[path] = {'ok': ok, 'message': message, 'latency_seconds': latency}
+            print('reconcile {} {} in {:.3f}s: {}'.format(path, 'done' if ok else 'failed', latency, message))
+
+    def step(self):
+        self.scan()
+        now = self.clock()
+        for path, (first_change, last_change) in list(self.pending.items()):
+            if now - last_change >= self.debounce:
+                del self.pending[path]
+                self.queue.setdefault(path, first_change)
+        self.collect()
+        for path in list(self.queue):
+            if len(self.running) >= self.workers:
+                break
+            # changed again while reconciling, wait for the running one
+            if path in self.running:
+                continue
+            first_change = self.queue.pop(path)
+            self.running[path] = (self.executor.submit(self.reconcile, path), first_change)
+
+    # returns (ok, message, dependencies)
+    def reconcile(self, path):
+        dependencies = {}
+        try:
+            args = ChainSpec.args_from_file(path)
+            # stat before reading, a change while reconciling is seen by the next scan
+            dependencies = gen_spec_dependencies(args)
+            spec = ChainSpec.from_args(args)
+            with self.chain_owners_lock:
+                # the spec may have renamed its chain, free the old name for other specs
+                for chain_name in [k for k, v in self.chain_owners.items() if v == path and k != spec.chain_name]:
+                    del self.chain_owners[chain_name]
+                owner = self.chain_owners.setdefault(spec.chain_name, path)
+            if owner != path:
+                raise InvalidChainSpec('chain {} is already defined by {}'.format(spec.chain_name, owner))
+            assign_node_ports(spec, gen_port_allocations_path(self.work_dir), self.port_range)
+            chain_dir = os.path.join(self.work_dir, spec.chain_name)
+            os.makedirs(chain_dir, exist_ok=True)
+            result = write_chain(spec, chain_dir, AtomicFileWriter(), self.jobs, validate=self.validate)
+        except (OperatorError, OSError) as e:
+            return False, str(e), dependencies
+        except Exception as e:
+            # a bug hit by one spec must not stop the chains of the other specs
+            return False, 'unexpected error: {}: {}'.format(type(e).__name__, e), dependencies
+        message = 'regenerated nodes: {}, skipped nodes: {}'.format(result.regenerated, result.skipped)
+        if result.failed_nodes:
+            return False, '{}, failed nodes: {}'.format(message, result.failed_nodes), dependencies
+        return True, message, dependencies
+
+    def status(self):
+        status = {
+            'queue_depth': self.queue_depth(),
+            'pending': len(self.pending),
+            'queued': len(self.queue),
+            'running': len(self.running),
+            'chains': self.results,
+        }
+        status.update(self.stats.to_dict())
+        return status
+
+    def write_status(self):
+        writer = AtomicFileWriter()
+        try:
+            writer.write(os.path.join(self.work_dir, STATUS_FILE_NAME), json.dumps(self.status(), indent=2, sort_keys=True))
+            writer.commit()
+        except BaseException:
+            writer.discard()
+            raise
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        self.collect()
+
+
+def run_daemon(args, work_dir):
+    watch_dir = os.path.abspath(args.watch_dir)
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    try:
+        port_range = parse_port_range(args.port_range)
+    except InvalidChainSpec as e:
+        print(e)
+        sys.exit(1)
+    reconciler = Reconciler(watch_dir, work_dir, args.debounce, args.workers, jobs, port_range=port_range, validate=args.validate)
+    print('watching {}, output to {}'.format(watch_dir, work_dir))
+    last_status = None
+    try:
+        while True:
+            reconciler.step()
+            status = reconciler.status()
+            if status != last_status:
+                reconciler.write_status()
+                last_status = status
+            time.sleep(args.watch_interval)
+    except KeyboardInterrupt:
+        print('stopping, waiting for running reconciles')
+    finally:
+        reconciler.shutdown()
+        reconciler.write_status()
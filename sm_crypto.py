@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# pylint: disable=missing-docstring
+
+import argparse
+import sys
+import time
+
+
+# order of the SM2 curve, private keys are in [1, SM2_N - 1]
+SM2_N = int('FFFFFFFEFFFFFFFFFFFFFFFFFFFFFFFF7203DF6B21C6052B53BBF40939D54123', 16)
+
+# NID_sm2 of OpenSSL
+OPENSSL_NID_SM2 = 1172
+
+# POINT_CONVERSION_UNCOMPRESSED of OpenSSL
+OPENSSL_POINT_UNCOMPRESSED = 4
+
+
+class CryptoBackendError(Exception):
+    pass
+
+
+def gen_private_key():
+    import secrets
+    return (secrets.randbelow(SM2_N - 1) + 1).to_bytes(32, 'big')
+
+
+# Public keys are the 64 bytes x || y, private keys are 32 bytes,
+# hash_msg returns the hex digest of SM3.
+class PysmxBackend:
+    name = 'pysmx'
+
+    def __init__(self):
+        try:
+            from pysmx.SM2._SM2 import kG, sm2_G
+            from pysmx.SM3 import hash_msg
+        except ImportError as e:
+            raise CryptoBackendError('pysmx is not available: {}'.format(e))
+        self._kG = kG
+        self._sm2_G = sm2_G
+        self._hash_msg = hash_msg
+
+    def public_key(self, sk):
+        return bytes.fromhex(self._kG(int.from_bytes(sk, 'big'), self._sm2_G, 64))
+
+    # pysmx.SM2.generate_keypair draws the private key from the random module,
+    # use a private key from secrets instead
+    def generate_keypair(self):
+        sk = gen_private_key()
+        return self.public_key(sk), sk
+
+    def hash_msg(self, msg):
+        return self._hash_msg(msg)
+
+
+# SM2 from libcrypto through ctypes, SM3 from hashlib
+class OpenSSLBackend:
+    name = 'openssl'
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        import hashlib
+
+        if 'sm3' not in hashlib.algorithms_available:
+            raise CryptoBackendError('sm3 is not available in hashlib')
+        self._hashlib = hashlib
+        path = ctypes.util.find_library('crypto')
+        if path is None:
+            raise CryptoBackendError('libcrypto is not found')
+        try:
+            lib = ctypes.CDLL(path)
+        except OSError as e:
+            raise CryptoBackendError('load libcrypto failed: {}'.format(e))
+
+        self._ctypes = ctypes
+        self._lib = lib
+        p = ctypes.c_void_p
+        signatures = {
+            'EC_GROUP_new_by_curve_name': (p, [ctypes.c_int]),
+            'EC_GROUP_free': (None, [p]),
+            'EC_POINT_new': (p, [p]),
+            'EC_POINT_free': (None, [p]),
+            'EC_POINT_mul': (ctypes.c_int, [p, p, p, p, p, p]),
+            'EC_POINT_point2oct': (ctypes.c_size_t, [p, p, ctypes.c_int, ctypes.c_char_p, ctypes.c_size_t, p]),
+            'BN_bin2bn': (p, [ctypes.c_char_p, ctypes.c_int, p]),
+            'BN_free': (None, [p]),
+        }
+        for name, (restype, argtypes) in signatures.items():
+            try:
+                func = getattr(lib, name)
+            except AttributeError:
+                raise CryptoBackendError('{} is not found in libcrypto'.format(name))
+            func.restype = restype
+            func.argtypes = argtypes
+
+        self._group = lib.EC_GROUP_new_by_curve_name(OPENSSL_NID_SM2)
+        if not self._group:
+            raise CryptoBackendError('SM2 curve is not available in libcrypto')
+
+    def __del__(self):
+        if getattr(self, '_group', None):
+            self._lib.EC_GROUP_free(self._group)
+
+    def public_key(self, sk):
+        lib = self._lib
+        bn = lib.BN_bin2bn(sk, len(sk), None)
+        point = lib.EC_POINT_new(self._group)
+        try:
+            if not bn or not point or lib.EC_POINT_mul(self._group, point, bn, None, None, None) != 1:
+                raise CryptoBackendError('EC_POINT_mul failed')
+            buf = self._ctypes.create_string_buffer(65)
+            if lib.EC_POINT_point2oct(self._group, point, OPENSSL_POINT_UNCOMPRESSED, buf, 65, None) != 65:
+                raise CryptoBackendError('EC_POINT_point2oct failed')
+            # skip the leading 0x04 of uncompressed point
+            return buf.raw[1:]
+        finally:
+            lib.EC_POINT_free(point)
+            lib.BN_free(bn)
+
+    def generate_keypair(self):
+        sk = gen_private_key()
+        return self.public_key(sk), sk
+
+    def hash_msg(self, msg):
+        return self._hashlib.new('sm3', msg).hexdigest()
+
+
+BACKENDS = {
+    PysmxBackend.name: PysmxBackend,
+    OpenSSLBackend.name: OpenSSLBackend,
+}
+
+BACKEND_AUTO = 'auto'
+
+# auto takes the first of them which loads, openssl is many times faster than pysmx;
+# timing the backends on every start costs more than generating one key, `bench` reports it instead
+BACKEND_PREFERENCE = [OpenSSLBackend.name, PysmxBackend.name]
+
+_backends = {}
+
+
+def available_backends():
+    backends = []
+    for name in BACKENDS:
+        try:
+            backends.append(get_backend(name))
+        except CryptoBackendError:
+            pass
+    return backends
+
+
+def address_of(backend, pk):
+    return '0x' + backend.hash_msg(pk)[24:]
+
+
+# keys per second of generating a keypair and its address
+def bench_backend(backend, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        pk, _ = backend.generate_keypair()
+        address_of(backend, pk)
+    return count / (time.perf_counter() - start)
+
+
+def select_preferred_backend():
+    errors = []
+    for name in BACKEND_PREFERENCE:
+        try:
+            return get_backend(name)
+        except CryptoBackendError as e:
+            errors.append(str(e))
+    raise CryptoBackendError('no crypto backend is available: {}'.format('; '.join(errors)))
+
+
+def get_backend(name=BACKEND_AUTO):
+    if name not in _backends:
+        if name == BACKEND_AUTO:
+            _backends[name] = select_preferred_backend()
+        elif name in BACKENDS:
+            _backends[name] = BACKENDS[name]()
+        else:
+            raise CryptoBackendError('unknown crypto backend: {}'.format(name))
+    return _backends[name]
+
+
+# derive public keys and addresses of the same private keys with every backend,
+# return the private keys whose results differ
+def cross_check(backends, count):
+    mismatches = []
+    for _ in range(count):
+        sk = gen_private_key()
+        results = set()
+        for backend in backends:
+            pk = backend.public_key(sk)
+            results.add((pk, address_of(backend, pk)))
+        if len(results) != 1:
+            mismatches.append(sk)
+    return mismatches
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(
+        dest='subcmd', title='subcommands', help='additional help')
+
+    pbench = subparsers.add_parser(
+        'bench', help='Report keys/sec of each available backend and the fastest one.')
+
+    pbench.add_argument(
+        '--count', type=int, default=50, help='Number of keys generated by each backend.')
+
+    pcheck = subparsers.add_parser(
+        'check', help='Check all available backends derive same addresses from same private keys.')
+
+    pcheck.add_argument(
+        '--count', type=int, default=100, help='Number of private keys to check.')
+
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_arguments()
+    backends = available_backends()
+    print('available backends:', [backend.name for backend in backends])
+    if args.subcmd == 'bench':
+        results = [(bench_backend(backend, args.count), backend.name) for backend in backends]
+        for keys_per_second, name in results:
+            print('{}: {:.1f} keys/sec'.format(name, keys_per_second))
+        print('fastest:', max(results)[1])
+    elif args.subcmd == 'check':
+        if len(backends) < 2:
+            print('need at least two backends to cross check')
+            sys.exit(1)
+        mismatches = cross_check(backends, args.count)
+        for sk in mismatches:
+            print('mismatch of private key:', '0x' + sk.hex())
+        if mismatches:
+            sys.exit(1)
+        print('{} keys checked, all backends agree'.format(args.count))
+
+
+if __name__ == '__main__':
+    main()
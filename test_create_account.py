@@ -0,0 +1,94 @@
+# -*- coding:utf-8 -*-
+# pylint: disable=missing-docstring
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'create_account.py')
+
+# prints progress, then the line kms create prints, with a new address for each run
+FAKE_KMS = '''#!/bin/sh
+echo "creating key"
+test -f key_file || exit 3
+touch kms.db
+echo "key_id:1,address:0x$(od -An -N20 -tx1 /dev/urandom | tr -d ' \\n')"
+'''
+
+FAILING_KMS = '''#!/bin/sh
+echo "kms.db is locked"
+exit 2
+'''
+
+
+def write_kms(tmp_path, content):
+    path = tmp_path / 'kms'
+    path.write_text(content)
+    path.chmod(0o755)
+    return str(path)
+
+
+def run_create_account(tmp_path, kms, *argv):
+    (tmp_path / 'key_file').write_text('password')
+    return subprocess.run(
+        [sys.executable, SCRIPT, '--kms', kms, '--key_file', 'key_file', '--work_dir', 'accounts'] + list(argv),
+        cwd=str(tmp_path), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+
+
+def account_dirs(work_dir):
+    return sorted(name for name in os.listdir(str(work_dir)) if name.startswith('0x'))
+
+
+@pytest.fixture
+def fake_kms(tmp_path):
+    return write_kms(tmp_path, FAKE_KMS)
+
+
+def test_batch(tmp_path, fake_kms):
+    result = run_create_account(tmp_path, fake_kms, '--count', '5', '--concurrency', '2')
+    assert result.returncode == 0, result.stdout
+    work_dir = tmp_path / 'accounts'
+    accounts = json.loads((work_dir / 'accounts.json').read_text())
+    assert sorted(account['index'] for account in accounts) == list(range(5))
+    assert sorted(account['address'] for account in accounts) == account_dirs(work_dir)
+    for account in accounts:
+        account_dir = work_dir / account['address']
+        assert (account_dir / 'node_address').read_text() == account['address']
+        assert (account_dir / 'key_id').read_text() == '1'
+        assert (account_dir / 'key_file').read_text() == 'password'
+        assert (account_dir / 'kms.db').exists()
+    # no temp dirs are left
+    assert sorted(os.listdir(str(work_dir))) == sorted(account_dirs(work_dir) + ['accounts.json'])
+
+
+def test_rerun_merges_manifest(tmp_path, fake_kms):
+    assert run_create_account(tmp_path, fake_kms, '--count', '2').returncode == 0
+    assert run_create_account(tmp_path, fake_kms, '--count', '3').returncode == 0
+    work_dir = tmp_path / 'accounts'
+    accounts = json.loads((work_dir / 'accounts.json').read_text())
+    assert [account['index'] for account in accounts] == [0, 1, 2, 3, 4]
+    assert sorted(account['address'] for account in accounts) == account_dirs(work_dir)
+
+
+def test_single_uses_options(tmp_path, fake_kms):
+    result = run_create_account(tmp_path, fake_kms)
+    assert result.returncode == 0, result.stdout
+    work_dir = tmp_path / 'accounts'
+    addresses = account_dirs(work_dir)
+    assert len(addresses) == 1
+    assert (work_dir / addresses[0] / 'node_address').read_text() == addresses[0]
+    assert not (work_dir / 'accounts.json').exists()
+
+
+def test_failed_kms(tmp_path):
+    kms = write_kms(tmp_path, FAILING_KMS)
+    result = run_create_account(tmp_path, kms, '--count', '2')
+    assert result.returncode == 1
+    assert 'kms.db is locked' in result.stdout
+    work_dir = tmp_path / 'accounts'
+    assert json.loads((work_dir / 'accounts.json').read_text()) == []
+    assert os.listdir(str(work_dir)) == ['accounts.json']
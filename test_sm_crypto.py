@@ -0,0 +1,53 @@
+# -*- coding:utf-8 -*-
+# pylint: disable=missing-docstring
+
+import pytest
+
+import sm_crypto
+
+
+# generator of the SM2 curve, the public key of private key 1
+SM2_G = bytes.fromhex(
+    '32C4AE2C1F1981195F9904466A39C9948FE30BBFF2660BE1715A4589334C74C7'
+    'BC3736A2F4F6779C59BDCEE36B692153D0A9877CC62A474002DF32E52139F0A0')
+
+# example 1 of GB/T 32905
+SM3_ABC = '66c7f0f462eeedd9d1f2d46bdc10e4e24167c4875cf2f7a2297da02b8f4ba8e0'
+
+
+def load_backend(name):
+    try:
+        return sm_crypto.get_backend(name)
+    except sm_crypto.CryptoBackendError as e:
+        pytest.skip(str(e))
+
+
+@pytest.mark.parametrize('name', sorted(sm_crypto.BACKENDS))
+def test_known_answers(name):
+    backend = load_backend(name)
+    assert backend.public_key((1).to_bytes(32, 'big')) == SM2_G
+    assert backend.hash_msg(b'abc') == SM3_ABC
+
+
+@pytest.mark.parametrize('name', sorted(sm_crypto.BACKENDS))
+def test_generate_keypair(name):
+    backend = load_backend(name)
+    pk, sk = backend.generate_keypair()
+    assert len(pk) == 64 and len(sk) == 32
+    assert backend.public_key(sk) == pk
+    assert len(sm_crypto.address_of(backend, pk)) == 42
+
+
+def test_backends_agree():
+    backends = sm_crypto.available_backends()
+    if len(backends) < 2:
+        pytest.skip('need at least two backends to cross check')
+    assert sm_crypto.cross_check(backends, 20) == []
+
+
+def test_auto_prefers_openssl():
+    backends = [backend.name for backend in sm_crypto.available_backends()]
+    if not backends:
+        pytest.skip('no crypto backend is available')
+    expected = next(name for name in sm_crypto.BACKEND_PREFERENCE if name in backends)
+    assert sm_crypto.get_backend(sm_crypto.BACKEND_AUTO).name == expected
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# pylint: disable=missing-docstring
+
+import argparse
+import json
+import os
+import sys
+
+import manifest_diff
+from cita_cloud_operator import gen_node_yaml_path, gen_chain_yaml_path, gen_quorum_size
+
+
+UPGRADE_PLAN_VERSION = 1
+
+DEFAULT_TIMEOUT = '10m'
+
+
+def gen_upgrade_plan_path(work_dir, chain_name):
+    return os.path.join(work_dir, '{}-upgrade-plan.json'.format(chain_name))
+
+
+def gen_upgrade_script_path(work_dir, chain_name):
+    return os.path.join(work_dir, '{}-upgrade.sh'.format(chain_name))
+
+
+# node indexes with a config file in work_dir
+def find_nodes(work_dir, chain_name):
+    nodes = []
+    while os.path.exists(gen_node_yaml_path(work_dir, chain_name, len(nodes))):
+        nodes.append(len(nodes))
+    return nodes
+
+
+# changes of one config file, restart is whether pods which are running now restart
+class FileChanges:
+    def __init__(self, node, file_name, old_objects, new_objects):
+        self.node = node
+        self.file_name = file_name
+        self.exists = bool(new_objects)
+        changes, rolls = manifest_diff.diff_manifests(old_objects, new_objects, manifest_diff.PATCH_TYPE_MERGE)
+        self.changes = changes
+        self.restart = rolls and bool(old_objects)
+        # workloads to wait for after apply
+        self.gates = ['{}/{}'.format(change['kind'].lower(), change['name'])
+                      for change in changes if change['kind'] in manifest_diff.WORKLOAD_KINDS and change['action'] != 'delete']
+        self.deletes = ['{}/{}'.format(change['kind'].lower(), change['name']) for change in changes if change['action'] == 'delete']
+
+
+def new_wave(name):
+    return {'name': name, 'nodes': [], 'apply': [], 'delete': [], 'gates': []}
+
+
+def add_to_wave(wave, file_changes):
+    wave['nodes'].append(file_changes.node)
+    if file_changes.exists:
+        wave['apply'].append(file_changes.file_name)
+    wave['delete'] += file_changes.deletes
+    wave['gates'] += file_changes.gates
+
+
+def plan_upgrade(chain_name, previous_dir, work_dir):
+    """Plan the upgrade from the config files in previous_dir to those in work_dir.
+
+    The nodes are upgraded in waves, a wave restarts at most f nodes of the 3f+1 nodes
+    running now, so the BFT quorum is kept. Changes which restart no pod go first,
+    nodes which join or leave the chain go last.
+    """
+    old_nodes = find_nodes(previous_dir, chain_name)
+    new_nodes = find_nodes(work_dir, chain_name)
+    peers_count = len(old_nodes)
+    max_unavailable = peers_count - gen_quorum_size(peers_count) if peers_count else 0
+
+    units = []
+    chain_file_name = os.path.basename(gen_chain_yaml_path(work_dir, chain_name))
+    units.append(FileChanges(
+        'chain',
+        chain_file_name,
+        manifest_diff.load_manifests(gen_chain_yaml_path(previous_dir, chain_name)),
+        manifest_diff.load_manifests(gen_chain_yaml_path(work_dir, chain_name))))
+    for i in sorted(set(old_nodes) | set(new_nodes)):
+        units.append(FileChanges(
+            i,
+            os.path.basename(gen_node_yaml_path(work_dir, chain_name, i)),
+            manifest_diff.load_manifests(gen_node_yaml_path(previous_dir, chain_name, i)),
+            manifest_diff.load_manifests(gen_node_yaml_path(work_dir, chain_name, i))))
+    units = [unit for unit in units if unit.changes]
+
+    prepare = new_wave('prepare')
+    rolling = []
+    membership = new_wave('membership')
+    for unit in units:
+        if unit.node != 'chain' and (unit.node not in old_nodes or unit.node not in new_nodes):
+            add_to_wave(membership, unit)
+        elif not unit.restart:
+            add_to_wave(prepare, unit)
+        elif unit.node == 'chain':
+            # pods of the StatefulSet are restarted one by one by its controller
+            wave = new_wave('rolling')
+            add_to_wave(wave, unit)
+            rolling.append(wave)
+        else:
+            if not rolling or rolling[-1]['nodes'] == ['chain'] or len(rolling[-1]['nodes']) >= max(max_unavailable, 1):
+                rolling.append(new_wave('rolling'))
+            add_to_wave(rolling[-1], unit)
+
+    waves = [wave for wave in [prepare] + rolling + [membership] if wave['nodes']]
+    return {
+        'version': UPGRADE_PLAN_VERSION,
+        'chainName': chain_name,
+        'peersCount': peers_count,
+        'maxUnavailable': max_unavailable,
+        'waves': waves,
+    }
+
+
+def gen_upgrade_script(plan, namespace, timeout):
+    kubectl = 'kubectl' if not namespace else 'kubectl -n {}'.format(namespace)
+    lines = [
+        '#!/bin/sh',
+        '# upgrade chain {}: {} nodes, at most {} of them restart at a time'.format(plan['chainName'], plan['peersCount'], max(plan['maxUnavailable'], 1)),
+        'set -e',
+        'cd "$(dirname "$0")"',
+    ]
+    for index, wave in enumerate(plan['waves']):
+        lines.append('')
+        lines.append('echo "wave {} ({}): nodes {}"'.format(index, wave['name'], ' '.join(str(node) for node in wave['nodes'])))
+        for file_name in wave['apply']:
+            lines.append('{} apply -f {}'.format(kubectl, file_name))
+        for resource in wave['delete']:
+            lines.append('{} delete {} --ignore-not-found'.format(kubectl, resource))
+        # the next wave starts only when the pods of this one are ready
+        for resource in wave['gates']:
+            lines.append('{} rollout status {} --timeout={}'.format(kubectl, resource, timeout))
+    lines.append('')
+    lines.append('echo "Done!!!"')
+    return '\n'.join(lines) + '\n'
+
+
+def write_upgrade_plan(plan, work_dir, namespace=None, timeout=DEFAULT_TIMEOUT):
+    plan_path = gen_upgrade_plan_path(work_dir, plan['chainName'])
+    with open(plan_path, 'wt') as stream:
+        json.dump(plan, stream, indent=2)
+    script_path = gen_upgrade_script_path(work_dir, plan['chainName'])
+    with open(script_path, 'wt') as stream:
+        stream.write(gen_upgrade_script(plan, namespace, timeout))
+    os.chmod(script_path, 0o755)
+    return plan_path, script_path
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--chain_name', default='test-chain', help='The name of chain.')
+
+    parser.add_argument(
+        '--previous_dir', required=True, help='The directory of the config files which are running now.')
+
+    parser.add_argument(
+        '--work_dir', default='.', help='The directory of the new config files, the plan is written here too.')
+
+    parser.add_argument(
+        '--namespace', help='Namespace of the chain, current namespace of kubectl if not set.')
+
+    parser.add_argument(
+        '--timeout', default=DEFAULT_TIMEOUT, help='How long to wait for the nodes of a wave to be ready.')
+
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_arguments()
+    work_dir = os.path.abspath(args.work_dir)
+    plan = plan_upgrade(args.chain_name, os.path.abspath(args.previous_dir), work_dir)
+    if not plan['waves']:
+        print('nothing to upgrade')
+        sys.exit(0)
+    if plan['peersCount'] and plan['maxUnavailable'] == 0:
+        print('warning: a chain of {} nodes tolerates no faulty node, it stops while each node restarts'.format(plan['peersCount']))
+    for index, wave in enumerate(plan['waves']):
+        print('wave {} ({}): nodes {}'.format(index, wave['name'], wave['nodes']))
+    plan_path, script_path = write_upgrade_plan(plan, work_dir, args.namespace, args.timeout)
+    print('upgrade plan:', plan_path)
+    print('upgrade script:', script_path)
+    print("Done!!!")
+
+
+if __name__ == '__main__':
+    main()